@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from array import array
+from pathlib import Path
+from typing import Annotated, Any
+
+import typer
+
+from consumer.answers import Answer
+from consumer.questions import QuestionCatalog, Questions, read_questions_from_file
+from consumer.settings import Settings
+from consumer.storage import Storage, open_storage
+
+cli = typer.Typer()
+
+CHOICES_COUNT = 4
+RATE_BUCKETS = 60
+
+
+class ChoiceDistribution:
+    """Answer counts of every choice, in a dense array indexed by question ordinal."""
+
+    __slots__ = ("catalog", "counts")
+
+    def __init__(self, catalog: QuestionCatalog) -> None:
+        self.catalog = catalog
+        self.counts = array("Q", bytes(8 * CHOICES_COUNT * len(catalog)))
+
+    def add(self, question_id: str, choice: int, count: int = 1) -> None:
+        ordinal = self.catalog.ordinals.get(question_id)
+        if ordinal is not None:
+            self.counts[ordinal * CHOICES_COUNT + choice] += count
+
+    def get(self, question_id: str) -> list[int]:
+        offset = self.catalog.ordinals[question_id] * CHOICES_COUNT
+        return self.counts[offset : offset + CHOICES_COUNT].tolist()
+
+    def as_dict(self) -> dict[str, list[int]]:
+        return {question_id: self.get(question_id) for question_id in self.catalog.ids}
+
+
+class AnswerRate:
+    """
+    Ring buffer of answer counts in fixed-width time buckets.
+
+    >>> rate = AnswerRate(bucket_seconds=1, size=3)
+    >>> rate.record(10.2); rate.record(10.7); rate.record(12.0)
+    >>> rate.series(now=12.5)
+    [2, 0, 1]
+    >>> rate.series(now=14.0)
+    [1, 0, 0]
+    """
+
+    __slots__ = ("bucket_seconds", "counts", "last_bucket")
+
+    def __init__(self, bucket_seconds: int, size: int) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.counts = array("Q", bytes(8 * size))
+        self.last_bucket = 0
+
+    def advance(self, now: float) -> None:
+        bucket = int(now // self.bucket_seconds)
+        size = len(self.counts)
+        for stale_bucket in range(
+            max(self.last_bucket + 1, bucket - size + 1), bucket + 1
+        ):
+            self.counts[stale_bucket % size] = 0
+        self.last_bucket = max(self.last_bucket, bucket)
+
+    def record(self, timestamp: float, count: int = 1) -> None:
+        self.advance(timestamp)
+        bucket = int(timestamp // self.bucket_seconds)
+        if bucket > self.last_bucket - len(self.counts):
+            self.counts[bucket % len(self.counts)] += count
+
+    def series(self, now: float | None = None) -> list[int]:
+        """Return the counts from the oldest to the current bucket."""
+        self.advance(time.time() if now is None else now)
+        size = len(self.counts)
+        start = (self.last_bucket + 1) % size
+        return [*self.counts[start:], *self.counts[:start]]
+
+
+class QuizActivity:
+    """Live aggregates of the quiz: choice distribution and answer rates."""
+
+    __slots__ = ("choices", "per_minute", "per_second")
+
+    def __init__(self, catalog: QuestionCatalog) -> None:
+        self.choices = ChoiceDistribution(catalog)
+        self.per_second = AnswerRate(bucket_seconds=1, size=RATE_BUCKETS)
+        self.per_minute = AnswerRate(bucket_seconds=60, size=RATE_BUCKETS)
+
+    def record(self, answer: Answer, replaced: int | None = None) -> None:
+        """Count the answer, moving the count off the `replaced` choice if any."""
+        received_at = answer.received_at
+        timestamp = time.time() if received_at is None else received_at.timestamp()
+        if replaced is not None:
+            self.choices.add(answer.question_id, replaced, -1)
+        self.choices.add(answer.question_id, answer.choice)
+        self.per_second.record(timestamp)
+        self.per_minute.record(timestamp)
+
+    def as_dict(self, now: float | None = None) -> dict[str, Any]:
+        return {
+            "choices": self.choices.as_dict(),
+            "answers_per_second": self.per_second.series(now),
+            "answers_per_minute": self.per_minute.series(now),
+        }
+
+
+async def activity_from_storage(
+    storage: Storage,
+    questions: Questions,
+) -> QuizActivity:
+    activity = QuizActivity(QuestionCatalog.from_questions(questions))
+    for (question_id, choice), count in (await storage.count_choices()).items():
+        activity.choices.add(question_id, choice, count)
+    window_seconds = activity.per_minute.bucket_seconds * len(
+        activity.per_minute.counts
+    )
+    per_second = await storage.count_answers_per_second(window_seconds)
+    for second, count in sorted(per_second.items()):
+        activity.per_second.record(second, count)
+        activity.per_minute.record(second, count)
+    return activity
+
+
+@cli.command("activity")
+def command_activity(
+    questions_file: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+) -> None:
+    questions = read_questions_from_file(questions_file)
+
+    async def backfill() -> QuizActivity:
+        async with open_storage(Settings()) as storage:
+            return await activity_from_storage(storage, questions)
+
+    activity = asyncio.run(backfill())
+    print(json.dumps(activity.as_dict(), indent=2))
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Literal, Self
+
+import logfire
+
+from consumer.wire import HEADER, RECORD, is_binary
+
+if TYPE_CHECKING:
+    import aiomqtt
+
+    from consumer.settings import Settings
+
+# Longer prefixes can't hold a MAC address, so there is no need to scan further
+MAX_KEY_LENGTH = 32
+MAC_SEPARATORS = b":-. \t"
+MAC_SIZE = 6
+HEX_DIGITS = frozenset(b"0123456789abcdef")
+
+type ShedReason = Literal["device", "global", "malformed"]
+
+shed_counter = logfire.metric_counter(
+    "consumer.messages.shed",
+    unit="1",
+    description="Messages dropped by admission control before being parsed",
+)
+
+
+def device_key(payload: bytes) -> bytes:
+    """
+    Cheaply extract a normalized device key from the payload, without validating it.
+
+    >>> device_key(b"2C-5C-D8-E8-02-8C|lorem ipsum 501|1")
+    b'2c5cd8e8028c'
+    >>> device_key(b"2c:5c:d8:e8:02:8c|lorem ipsum 501|1")
+    b'2c5cd8e8028c'
+    """
+    prefix, _, _ = payload[:MAX_KEY_LENGTH].partition(b"|")
+    return prefix.translate(None, MAC_SEPARATORS).lower()
+
+
+def is_device_key(key: bytes) -> bool:
+    """
+    Tell whether the key can be a MAC address, unlike e.g. quiz control actions.
+
+    >>> is_device_key(b"2c5cd8e8028c"), is_device_key(b"open")
+    (True, False)
+    """
+    return len(key) == MAC_SIZE * 2 and HEX_DIGITS.issuperset(key)
+
+
+def record_keys(records: bytes) -> Counter[bytes]:
+    """
+    Count the binary records of every device, keyed like `device_key` does.
+
+    >>> record_keys(bytes.fromhex("2c5cd8e8028c 0001 02 2c5cd8e8028c 0002 01"))
+    Counter({b'2c5cd8e8028c': 2})
+    """
+    return Counter(
+        records[offset : offset + MAC_SIZE].hex().encode()
+        for offset in range(0, len(records), RECORD.size)
+    )
+
+
+def payload_keys(payload: bytes, *, headerless: bool = False) -> Counter[bytes]:
+    """Count the answers of every device in a text or binary payload."""
+    # A headerless record may start with the magic byte too, never sniff those
+    if headerless:
+        return record_keys(payload)
+    if is_binary(payload):
+        return record_keys(payload[HEADER.size :])
+    return Counter({device_key(payload): 1})
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float) -> None:
+        self.tokens = tokens
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float, cost: int = 1) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+
+class AdmissionControl:
+    """
+    Per-device and global token buckets, checked before a message is even decoded.
+
+    Buckets of the least recently seen devices are evicted past `max_devices`,
+    an evicted device simply starts over with a full bucket. Every answer of a
+    binary batch costs a token of its device. Payloads without a MAC address
+    where one is expected are dropped, and messages on `exempt_topics` pass.
+
+    >>> admission = AdmissionControl(device_rate=1, device_burst=2, global_rate=100)
+    >>> [admission.admit(b"aa:bb:cc:dd:ee:ff|q|1", now=0) for _ in range(3)]
+    [True, True, False]
+    >>> admission.admit(b"aa:bb:cc:dd:ee:ff|q|1", now=1)
+    True
+    >>> admission.shed
+    Counter({'device': 1})
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        device_rate: float,
+        device_burst: float,
+        global_rate: float,
+        global_burst: float | None = None,
+        max_devices: int = 65_536,
+        binary_topics: Sequence[str] = (),
+        exempt_topics: Sequence[str] = (),
+    ) -> None:
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.global_rate = global_rate
+        self.global_burst = global_rate if global_burst is None else global_burst
+        self.max_devices = max_devices
+        self.binary_topics = binary_topics
+        self.exempt_topics = exempt_topics
+        self.buckets: OrderedDict[bytes, TokenBucket] = OrderedDict()
+        self.global_bucket = TokenBucket(self.global_burst, now=0.0)
+        self.shed: Counter[ShedReason] = Counter()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> Self:
+        return cls(
+            device_rate=settings.admission_device_rate,
+            device_burst=settings.admission_device_burst,
+            global_rate=settings.admission_global_rate,
+            max_devices=settings.admission_max_devices,
+            binary_topics=settings.binary_topics,
+            # Quiz control messages come from the host, never from a device
+            exempt_topics=[settings.control_topic],
+        )
+
+    def admit_message(self, message: aiomqtt.Message) -> bool:
+        if not isinstance(message.payload, bytes) or any(
+            message.topic.matches(topic) for topic in self.exempt_topics
+        ):
+            return True
+        headerless = any(message.topic.matches(topic) for topic in self.binary_topics)
+        return self.admit(message.payload, headerless=headerless)
+
+    def admit(
+        self,
+        payload: bytes,
+        now: float | None = None,
+        *,
+        headerless: bool = False,
+    ) -> bool:
+        if now is None:
+            now = time.monotonic()
+        keys = payload_keys(payload, headerless=headerless)
+        # Nothing could be parsed from these anyway, they'd only occupy buckets
+        if not keys or not all(map(is_device_key, keys)):
+            self.reject("malformed")
+            return False
+        for key, cost in keys.items():
+            if not self.get_bucket(key, now).take(
+                self.device_rate, self.device_burst, now, cost
+            ):
+                self.reject("device")
+                return False
+        if not self.global_bucket.take(
+            self.global_rate, self.global_burst, now, keys.total()
+        ):
+            self.reject("global")
+            return False
+        return True
+
+    def get_bucket(self, key: bytes, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.device_burst, now)
+            if len(self.buckets) > self.max_devices:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def reject(self, reason: ShedReason) -> None:
+        self.shed[reason] += 1
+        shed_counter.add(1, {"reason": reason})
@@ -0,0 +1,363 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections.abc import AsyncGenerator, AsyncIterator, Sequence
+from contextlib import asynccontextmanager, suppress
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Annotated, Protocol
+
+import logfire
+import typer
+from pydantic import BaseModel, ValidationError
+from pydantic_extra_types.mac_address import MacAddress
+
+from consumer.answers import (
+    FIRST_WINS,
+    Answer,
+    ConflictPolicy,
+    DeletedTotal,
+    DeviceID,
+    int_to_mac,
+    mac_to_int,
+)
+from consumer.questions import Questions, read_questions_from_file
+from consumer.settings import Settings, get_mqtt_client
+from consumer.stats import Statistics, write_snapshot
+from consumer.storage import Storage
+
+cli = typer.Typer()
+
+type DeltaKey = tuple[int, str]
+# (received at, node, choice, kept under a last-wins policy)
+type DeltaVersion = tuple[float, str, int, bool]
+# (device ID, question ID, choice, received at, kept under a last-wins policy)
+type DeltaAnswer = tuple[int, str, int, float, bool]
+
+
+class Delta(BaseModel):
+    """Answers a node kept since its previous delta."""
+
+    node: str
+    seq: int
+    answers: list[DeltaAnswer]
+
+
+def rank(version: DeltaVersion) -> tuple[bool, float, str, int]:
+    """
+    Order versions so that the kept one is the greatest, a total order.
+
+    Should one answer be kept under both policies, last-wins prevails.
+    """
+    received_at, node, choice, last_wins = version
+    return last_wins, received_at if last_wins else -received_at, node, choice
+
+
+class GlobalView:
+    """
+    Answers merged from every node, a CRDT map of max-registers.
+
+    Each answer key keeps its greatest version in `rank` order: the earliest
+    answer kept under first-wins, the latest one kept under last-wins, like
+    the nodes do. Merging is commutative and idempotent, so duplicated or
+    reordered deltas end up in the same view and never count an answer twice.
+    The `leaderboard` follows every changed answer instead of being rebuilt.
+
+    >>> first = Delta(node="a", seq=0, answers=[(1, "q", 0, 10.0, False)])
+    >>> later = Delta(
+    ...     node="b",
+    ...     seq=0,
+    ...     answers=[(1, "q", 2, 20.0, False), (2, "q", 1, 5.0, True)],
+    ... )
+    >>> last = Delta(node="a", seq=1, answers=[(2, "q", 3, 8.0, True)])
+    >>> view, other = GlobalView({}), GlobalView({})
+    >>> view.merge(first), view.merge(later), view.merge(last), view.merge(first)
+    (1, 1, 1, 0)
+    >>> other.merge(last), other.merge(later), other.merge(first)
+    (1, 1, 1)
+    >>> view.answers == other.answers
+    True
+    >>> view.answers
+    {(1, 'q'): (10.0, 'a', 0, False), (2, 'q'): (8.0, 'a', 3, True)}
+    """
+
+    def __init__(self, questions: Questions) -> None:
+        self.answers: dict[DeltaKey, DeltaVersion] = {}
+        self.questions = questions
+        self.leaderboard = Statistics.from_questions(questions)
+
+    def merge(self, delta: Delta) -> int:
+        """Merge the delta in and return how many answers it changed."""
+        changed = 0
+        for device_id, question_id, choice, received_at, last_wins in delta.answers:
+            key = device_id, question_id
+            version = received_at, delta.node, choice, last_wins
+            current = self.answers.get(key)
+            if current is None or rank(version) > rank(current):
+                self.answers[key] = version
+                self.update_leaderboard(key, version)
+                changed += 1
+        return changed
+
+    def update_leaderboard(self, key: DeltaKey, version: DeltaVersion) -> None:
+        device_id, question_id = key
+        received_at, _, choice, _ = version
+        question = self.questions.get(question_id)
+        if question is None:
+            return
+        answer = Answer.model_construct(
+            received_at=datetime.fromtimestamp(received_at, UTC),
+            device_id=MacAddress(int_to_mac(device_id)),
+            question_id=question_id,
+            choice=choice,
+        )
+        self.leaderboard.add_answer(question, answer)
+
+
+class DeltaRecorder:
+    """Storage wrapper remembering the kept answers that weren't published yet."""
+
+    def __init__(self, storage: Storage, node: str) -> None:
+        self.storage = storage
+        self.node = node
+        self.pending: list[DeltaAnswer] = []
+        self.seq = itertools.count()
+
+    async def save_answers(
+        self,
+        answers: Sequence[Answer],
+        policy: ConflictPolicy = FIRST_WINS,
+    ) -> list[Answer]:
+        kept = await self.storage.save_answers(answers, policy)
+        self.pending.extend(
+            (
+                mac_to_int(answer.device_id),
+                answer.question_id,
+                answer.choice,
+                answer.received_at.timestamp() if answer.received_at else 0.0,
+                policy.last_wins,
+            )
+            for answer in kept
+        )
+        return kept
+
+    def take_delta(self) -> Delta | None:
+        if not self.pending:
+            return None
+        pending, self.pending = self.pending, []
+        return Delta(node=self.node, seq=next(self.seq), answers=pending)
+
+    async def is_answered(self, device_id: DeviceID, question_id: str) -> bool:
+        return await self.storage.is_answered(device_id, question_id)
+
+    async def load_answers(self) -> Sequence[Answer]:
+        return await self.storage.load_answers()
+
+    def stream_answers(
+        self,
+        *,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        chunk_size: int = 10_000,
+    ) -> AsyncIterator[Sequence[Answer]]:
+        return self.storage.stream_answers(
+            since=since, until=until, chunk_size=chunk_size
+        )
+
+    async def count_choices(self) -> dict[tuple[str, int], int]:
+        return await self.storage.count_choices()
+
+    async def count_answers_per_second(self, window_seconds: int) -> dict[int, int]:
+        return await self.storage.count_answers_per_second(window_seconds)
+
+    async def prune(self) -> DeletedTotal:
+        return await self.storage.prune()
+
+
+class DeltaSink(Protocol):
+    async def send(self, delta: Delta) -> None: ...
+
+
+class SpoolSink:
+    """Deltas written as files into a directory shared with the aggregator."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    async def send(self, delta: Delta) -> None:
+        # Sequence numbers restart with the consumer, the clock keeps names unique
+        path = self.directory / f"{delta.node}-{time.time_ns()}-{delta.seq}.json"
+        partial_path = path.with_suffix(".tmp")
+        await asyncio.to_thread(self.directory.mkdir, parents=True, exist_ok=True)
+        await asyncio.to_thread(partial_path.write_text, delta.model_dump_json())
+        # Renaming is atomic, so the aggregator never reads a partial delta
+        await asyncio.to_thread(partial_path.rename, path)
+
+
+class MQTTSink:
+    """Deltas published to a topic, connecting only for the rare publish."""
+
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+
+    async def send(self, delta: Delta) -> None:
+        async with get_mqtt_client(self.settings.mqtt) as client:
+            await client.publish(
+                self.settings.delta_topic, delta.model_dump_json(), qos=1
+            )
+
+
+def get_delta_sink(settings: Settings) -> DeltaSink | None:
+    match settings.delta_sink:
+        case "spool":
+            return SpoolSink(settings.delta_spool)
+        case "mqtt":
+            return MQTTSink(settings)
+        case "none":
+            return None
+
+
+async def publish_delta(recorder: DeltaRecorder, sink: DeltaSink) -> None:
+    delta = recorder.take_delta()
+    if delta is None:
+        return
+    try:
+        await sink.send(delta)
+    except Exception:  # noqa: BLE001
+        # Merging is idempotent, so resending answers in the next delta is harmless
+        recorder.pending[:0] = delta.answers
+        logfire.exception("Failed to publish delta {seq}", seq=delta.seq)
+    else:
+        logfire.info(
+            "Published {count} answer(s) in delta {seq}",
+            count=len(delta.answers),
+            seq=delta.seq,
+        )
+
+
+@asynccontextmanager
+async def publishing_deltas(
+    storage: Storage,
+    settings: Settings,
+) -> AsyncGenerator[Storage]:
+    """Periodically publish the answers kept by `storage` for `aggregate` to merge."""
+    sink = get_delta_sink(settings)
+    if sink is None:
+        yield storage
+        return
+
+    recorder = DeltaRecorder(storage, node=settings.node_id)
+
+    async def publish_periodically() -> None:
+        while True:
+            await asyncio.sleep(settings.delta_interval)
+            await publish_delta(recorder, sink)
+
+    publisher = asyncio.create_task(publish_periodically())
+    try:
+        yield recorder
+    finally:
+        publisher.cancel()
+        with suppress(asyncio.CancelledError):
+            await publisher
+        await publish_delta(recorder, sink)
+
+
+def read_spooled_deltas(directory: Path, seen: set[str]) -> list[Delta]:
+    deltas: list[Delta] = []
+    for path in sorted(directory.glob("*.json")):
+        if path.name in seen:
+            continue
+        try:
+            deltas.append(Delta.model_validate_json(path.read_bytes()))
+        except ValidationError:
+            logfire.exception("Skipping malformed delta {path}", path=path)
+        seen.add(path.name)
+    return deltas
+
+
+async def write_view(view: GlobalView, output: Path) -> None:
+    snapshot = view.leaderboard.snapshot()
+    await asyncio.to_thread(write_snapshot, snapshot, output)
+    logfire.info(
+        "Wrote statistics of {devices} device(s) to {output}",
+        devices=len(snapshot),
+        output=output,
+    )
+
+
+async def aggregate_spool(
+    directory: Path,
+    questions: Questions,
+    output: Path,
+    *,
+    interval: float | None,
+) -> GlobalView:
+    view = GlobalView(questions)
+    seen: set[str] = set()
+    while True:
+        deltas = await asyncio.to_thread(read_spooled_deltas, directory, seen)
+        if sum(map(view.merge, deltas)):
+            await write_view(view, output)
+        if interval is None:
+            return view
+        await asyncio.sleep(interval)
+
+
+async def receive_delta(
+    view: GlobalView, spool: SpoolSink, payload: bytes, output: Path
+) -> None:
+    try:
+        delta = Delta.model_validate_json(payload)
+    except ValidationError:
+        logfire.exception("Skipping malformed delta")
+        return
+    # Spooled before it's merged, so that a restart rebuilds the view from the spool
+    await spool.send(delta)
+    if view.merge(delta):
+        await write_view(view, output)
+
+
+async def aggregate_mqtt(
+    settings: Settings, questions: Questions, output: Path
+) -> None:
+    spool = SpoolSink(settings.delta_spool)
+    view = await aggregate_spool(spool.directory, questions, output, interval=None)
+    # Consumers drop a delta once it's published, so the broker must keep the ones
+    # published while the aggregator is down, in a persistent session
+    client = get_mqtt_client(
+        settings.mqtt, identifier=settings.aggregator_id, clean_session=False
+    )
+    async with client:
+        await client.subscribe(settings.delta_topic, qos=1)
+        logfire.info("Aggregating deltas from `{topic}`", topic=settings.delta_topic)
+        async for message in client.messages:
+            if isinstance(message.payload, bytes):
+                await receive_delta(view, spool, message.payload, output)
+
+
+@cli.command("aggregate")
+def command_aggregate(
+    questions_file: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    output: Annotated[Path, typer.Option()] = Path("leaderboard.json"),
+    *,
+    spool: Annotated[
+        bool,
+        typer.Option(help="Read deltas from SUBSCRIBER_DELTA_SPOOL instead of MQTT."),
+    ] = False,
+    once: Annotated[
+        bool,
+        typer.Option(help="Merge the spooled deltas once and exit."),
+    ] = False,
+) -> None:
+    settings = Settings()
+    questions = read_questions_from_file(questions_file)
+    if spool:
+        interval = None if once else settings.delta_interval
+        asyncio.run(
+            aggregate_spool(settings.delta_spool, questions, output, interval=interval)
+        )
+    else:
+        asyncio.run(aggregate_mqtt(settings, questions, output))
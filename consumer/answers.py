@@ -1,45 +1,120 @@
-import asyncio
-from datetime import datetime
+from collections.abc import AsyncGenerator, Collection, Sequence
+from datetime import UTC, datetime
 from typing import Annotated, Literal, NewType, Self
 
 import logfire
-import typer
-from pydantic import AfterValidator, BeforeValidator, TypeAdapter, ValidationError
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncEngine
-from sqlmodel import TIMESTAMP, Column, Field, SQLModel, delete, text
+from pydantic import (
+    AfterValidator,
+    AwareDatetime,
+    BaseModel,
+    BeforeValidator,
+    TypeAdapter,
+    ValidationError,
+    model_validator,
+)
+from pydantic_extra_types.mac_address import MacAddress
+from sqlalchemy import (
+    BigInteger,
+    Integer,
+    ScalarSelect,
+    cast,
+    exists,
+    func,
+    tuple_,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.sql.dml import ReturningInsert
+from sqlmodel import TIMESTAMP, Column, Field, SQLModel, col, delete, select, text
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.main import SQLModelConfig  # type: ignore[attr-defined]
 
-from consumer.settings import Settings, get_db
-
-cli = typer.Typer()
-
 type Choices = Literal[0, 1, 2, 3]
 type DeviceID = str
+type ConflictMode = Literal["first-wins", "last-wins", "last-wins-until-deadline"]
 DeletedTotal = NewType("DeletedTotal", int)
 
+MAC_ADDRESS_SIZE = 6
+MAC_ADDRESS_SEPARATORS = str.maketrans("", "", ":-.")
 
-class Answer(SQLModel, table=True):
-    __tablename__ = "answers"
 
-    model_config = SQLModelConfig(validate_assignment=True)
+def mac_to_int(mac_address: str) -> int:
+    """
+    Pack a MAC address into a 48-bit integer.
+
+    >>> mac_to_int("00:b0:d0:63:c2:26")
+    759410442790
+    >>> mac_to_int("00-B0-D0-63-C2-26")
+    759410442790
+    >>> mac_to_int("00:b0:d0:63:c2:26:ff:ff")
+    Traceback (most recent call last):
+    ...
+    ValueError: expected a 48-bit MAC address, got '00:b0:d0:63:c2:26:ff:ff'
+    """
+    packed = bytes.fromhex(mac_address.translate(MAC_ADDRESS_SEPARATORS))
+    if len(packed) != MAC_ADDRESS_SIZE:
+        msg = f"expected a 48-bit MAC address, got {mac_address!r}"
+        raise ValueError(msg)
+    return int.from_bytes(packed)
+
+
+def int_to_mac(value: int) -> DeviceID:
+    """
+    Unpack a 48-bit integer into a MAC address.
+
+    >>> int_to_mac(759410442790)
+    '00:b0:d0:63:c2:26'
+    """
+    return value.to_bytes(MAC_ADDRESS_SIZE).hex(":")
+
+
+def check_mac_size(mac_address: str) -> str:
+    mac_to_int(mac_address)
+    return mac_address
+
+
+class QuestionRecord(SQLModel, table=True):
+    """Interned question ID, so that answers can refer to it by an integer key."""
+
+    __tablename__ = "questions"
+
+    id: Annotated[int | None, Field(default=None, primary_key=True)]
+    external_id: Annotated[str, Field(unique=True)]
+
+
+class AnswerRecord(SQLModel, table=True):
+    """Row of the `answers` table, clustered on (device, question)."""
+
+    __tablename__ = "answers"
+    __table_args__ = {"sqlite_with_rowid": False}
 
     received_at: Annotated[
         datetime | None,
         Field(
             default=None,
-            repr=False,
-            exclude=True,
             sa_column=Column(
                 TIMESTAMP(timezone=True),
                 nullable=False,
                 server_default=text("CURRENT_TIMESTAMP"),
+                index=True,
             ),
         ),
     ]
-    device_id: Annotated[str, Field(primary_key=True)]  # can't use DeviceID directly
-    question_id: Annotated[str, BeforeValidator(str.strip), Field(primary_key=True)]
+    device_id: Annotated[int, Field(primary_key=True, sa_type=BigInteger)]
+    question_id: Annotated[int, Field(primary_key=True, foreign_key="questions.id")]
+    choice: int
+
+
+class Answer(SQLModel):
+    model_config = SQLModelConfig(validate_assignment=True)
+
+    received_at: Annotated[
+        datetime | None,
+        Field(default=None, repr=False, exclude=True),
+    ]
+    device_id: Annotated[MacAddress, AfterValidator(check_mac_size)]
+    question_id: Annotated[str, BeforeValidator(str.strip)]
     choice: Annotated[int, AfterValidator(TypeAdapter(Choices).validate_python)]
 
     @classmethod
@@ -75,36 +150,300 @@ class Answer(SQLModel, table=True):
         )
 
 
-async def save_answer(answer: Answer, db: AsyncEngine) -> bool:
-    # Committing the answer cleans the model, so save its representation for later
-    async with AsyncSession(db, expire_on_commit=False) as session:
-        session.add(answer)
-        try:
-            await session.commit()
-        except IntegrityError:
-            # Assumption: integrity check can only fail for duplicate PKs
-            logfire.error("Skipped {answer} (already answered)", answer=answer)
-            await session.rollback()
-        except SQLAlchemyError:
-            logfire.exception(
-                "Ignoring exception during persisting {answer}",
-                answer=answer,
+class ConflictPolicy(BaseModel, frozen=True):
+    """
+    Which answer is kept when a device answers the same question again.
+
+    >>> ConflictPolicy(mode="last-wins-until-deadline")  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    pydantic_core._pydantic_core.ValidationError: 1 validation error for ConflictPolicy
+    ...
+    """
+
+    mode: ConflictMode = "first-wins"
+    deadline: AwareDatetime | None = None
+
+    @model_validator(mode="after")
+    def check_deadline(self) -> Self:
+        if self.mode == "last-wins-until-deadline" and self.deadline is None:
+            msg = "the last-wins-until-deadline mode requires a deadline"
+            raise ValueError(msg)
+        return self
+
+    @property
+    def last_wins(self) -> bool:
+        return self.mode != "first-wins"
+
+    def resolve(self, answers: Sequence[Answer]) -> list[Answer]:
+        """
+        Keep at most one answer per device and question from a stamped batch.
+
+        Answers past the deadline are dropped and, among duplicates, the first
+        or the last one is kept, like the database would do one by one.
+        """
+        deadline = self.deadline if self.mode == "last-wins-until-deadline" else None
+        by_key: dict[tuple[DeviceID, str], Answer] = {}
+        for answer in answers:
+            if deadline and answer.received_at and answer.received_at > deadline:
+                continue
+            key = answer.device_id, answer.question_id
+            if self.last_wins:
+                by_key.pop(key, None)
+                by_key[key] = answer
+            else:
+                by_key.setdefault(key, answer)
+        return list(by_key.values())
+
+
+FIRST_WINS = ConflictPolicy()
+
+
+def question_key(question_id: str) -> ScalarSelect[int | None]:
+    return (
+        select(QuestionRecord.id)
+        .where(QuestionRecord.external_id == question_id)
+        .scalar_subquery()
+    )
+
+
+async def intern_questions(
+    connection: AsyncConnection,
+    question_ids: Collection[str],
+) -> dict[str, int]:
+    await connection.execute(
+        sqlite_insert(QuestionRecord).on_conflict_do_nothing(
+            index_elements=["external_id"]
+        ),
+        [{"external_id": question_id} for question_id in question_ids],
+    )
+    result = await connection.execute(
+        select(QuestionRecord.external_id, QuestionRecord.id).where(
+            col(QuestionRecord.external_id).in_(question_ids)
+        )
+    )
+    return dict(result.tuples().all())
+
+
+def upsert_answers(policy: ConflictPolicy) -> ReturningInsert[tuple[int, int]]:
+    insert = sqlite_insert(AnswerRecord)
+    if policy.last_wins:
+        statement = insert.on_conflict_do_update(
+            index_elements=[col(AnswerRecord.device_id), col(AnswerRecord.question_id)],
+            set_={
+                "choice": insert.excluded.choice,
+                "received_at": insert.excluded.received_at,
+            },
+            # Never let an older answer replace a newer one
+            where=insert.excluded.received_at >= col(AnswerRecord.received_at),
+        )
+    else:
+        statement = insert.on_conflict_do_nothing()
+    return statement.returning(
+        col(AnswerRecord.device_id), col(AnswerRecord.question_id)
+    )
+
+
+def as_utc(at: datetime) -> datetime:
+    """
+    Normalize a timestamp to UTC, SQLite hands them back naive.
+
+    >>> as_utc(datetime(2025, 5, 10, 12))
+    datetime.datetime(2025, 5, 10, 12, 0, tzinfo=datetime.timezone.utc)
+    """
+    return at.replace(tzinfo=UTC) if at.tzinfo is None else at.astimezone(UTC)
+
+
+def stamp_answers(answers: Sequence[Answer]) -> list[Answer]:
+    received_at = datetime.now(UTC)
+    return [
+        answer
+        if answer.received_at
+        else answer.model_copy(update={"received_at": received_at})
+        for answer in answers
+    ]
+
+
+async def save_answers(
+    answers: Sequence[Answer],
+    db: AsyncEngine,
+    policy: ConflictPolicy = FIRST_WINS,
+) -> list[Answer]:
+    """Persist a batch of answers and return the ones the database kept."""
+    answers = policy.resolve(stamp_answers(answers))
+    if not answers:
+        return []
+    try:
+        async with db.begin() as connection:
+            keys = await intern_questions(
+                connection, {answer.question_id for answer in answers}
+            )
+            result = await connection.execute(
+                upsert_answers(policy),
+                [
+                    {
+                        "received_at": answer.received_at,
+                        "device_id": mac_to_int(answer.device_id),
+                        "question_id": keys[answer.question_id],
+                        "choice": answer.choice,
+                    }
+                    for answer in answers
+                ],
             )
-        else:
-            logfire.info("Saved {answer}", answer=answer)
-            return True
+            kept_keys = set(result.tuples().all())
+    except SQLAlchemyError:
+        logfire.exception(
+            "Ignoring exception during persisting {total} answer(s)",
+            total=len(answers),
+        )
+        return []
+
+    return [
+        answer
+        for answer in answers
+        if (mac_to_int(answer.device_id), keys[answer.question_id]) in kept_keys
+    ]
+
+
+async def save_answer(
+    answer: Answer,
+    db: AsyncEngine,
+    policy: ConflictPolicy = FIRST_WINS,
+) -> bool:
+    if await save_answers([answer], db, policy):
+        logfire.info("Saved {answer}", answer=answer)
+        return True
+    logfire.error("Skipped {answer} (already answered)", answer=answer)
     return False
 
 
-async def prune_all_answers(*, settings: Settings) -> DeletedTotal:
-    async with get_db(settings.db_path) as db, AsyncSession(db) as session:
-        result = await session.exec(delete(Answer).returning(Answer))  # type: ignore[call-overload]
+async def is_answered(db: AsyncEngine, device_id: DeviceID, question_id: str) -> bool:
+    statement = select(
+        exists().where(
+            col(AnswerRecord.device_id) == mac_to_int(device_id),
+            col(AnswerRecord.question_id) == question_key(question_id),
+        )
+    )
+    async with AsyncSession(db) as session:
+        return bool((await session.exec(statement)).one())
+
+
+async def load_answers(db: AsyncEngine) -> Sequence[Answer]:
+    statement = select(
+        AnswerRecord.received_at,
+        AnswerRecord.device_id,
+        QuestionRecord.external_id,
+        AnswerRecord.choice,
+    ).join(QuestionRecord)
+    async with AsyncSession(db) as session:
+        rows = (await session.exec(statement)).all()
+    # Rows were validated before they got persisted, skip revalidating them
+    return [
+        Answer.model_construct(
+            received_at=received_at and as_utc(received_at),
+            device_id=MacAddress(int_to_mac(device_id)),
+            question_id=question_id,
+            choice=choice,
+        )
+        for received_at, device_id, question_id, choice in rows
+    ]
+
+
+async def stream_answers(
+    db: AsyncEngine,
+    *,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    chunk_size: int = 10_000,
+) -> AsyncGenerator[list[Answer]]:
+    """
+    Yield answers received after `since` up to `until` in chunks, oldest first.
+
+    Every chunk is read in its own short transaction, continuing after the last
+    row of the previous one, so that writers are never locked out for a whole
+    export.
+    """
+    statement = (
+        select(
+            AnswerRecord.received_at,
+            AnswerRecord.device_id,
+            QuestionRecord.external_id,
+            AnswerRecord.choice,
+        )
+        .join(QuestionRecord)
+        .order_by(
+            col(AnswerRecord.received_at),
+            col(AnswerRecord.device_id),
+            col(QuestionRecord.external_id),
+        )
+        .limit(chunk_size)
+    )
+    if since is not None:
+        statement = statement.where(col(AnswerRecord.received_at) > since)
+    if until is not None:
+        statement = statement.where(col(AnswerRecord.received_at) <= until)
+    chunk = statement
+    while True:
+        async with AsyncSession(db) as session:
+            rows = (await session.exec(chunk)).all()
+        if not rows:
+            return
+        yield [
+            Answer.model_construct(
+                received_at=received_at and as_utc(received_at),
+                device_id=MacAddress(int_to_mac(device_id)),
+                question_id=question_id,
+                choice=choice,
+            )
+            for received_at, device_id, question_id, choice in rows
+        ]
+        last_received_at, last_device_id, last_question_id, _ = rows[-1]
+        chunk = statement.where(
+            # The first bound alone is served by the index on `received_at`
+            col(AnswerRecord.received_at) >= last_received_at,
+            tuple_(
+                col(AnswerRecord.received_at),
+                col(AnswerRecord.device_id),
+                col(QuestionRecord.external_id),
+            )
+            > (last_received_at, last_device_id, last_question_id),
+        )
+
+
+async def count_choices(db: AsyncEngine) -> dict[tuple[str, int], int]:
+    statement = (
+        select(QuestionRecord.external_id, AnswerRecord.choice, func.count())
+        .join(QuestionRecord)
+        .group_by(col(QuestionRecord.external_id), col(AnswerRecord.choice))
+    )
+    async with AsyncSession(db) as session:
+        return {
+            (question_id, choice): count
+            for question_id, choice, count in await session.exec(statement)
+        }
+
+
+async def count_answers_per_second(
+    db: AsyncEngine,
+    window_seconds: int,
+) -> dict[int, int]:
+    received_second = cast(func.strftime("%s", AnswerRecord.received_at), Integer)
+    # Served by the index on `received_at`, only the recent rows are visited
+    statement = (
+        select(received_second, func.count())
+        .where(
+            col(AnswerRecord.received_at)
+            >= func.datetime("now", f"-{window_seconds} seconds")
+        )
+        .group_by(received_second)
+    )
+    async with AsyncSession(db) as session:
+        return dict((await session.exec(statement)).all())
+
+
+async def prune_answers(db: AsyncEngine) -> DeletedTotal:
+    async with AsyncSession(db) as session:
+        result = await session.exec(delete(AnswerRecord).returning(AnswerRecord))  # type: ignore[call-overload]
         total = len(result.fetchall())
         await session.commit()
     return DeletedTotal(total)
-
-
-@cli.command("prune")
-def command_prune() -> None:
-    total = asyncio.run(prune_all_answers(settings=Settings()))
-    logfire.info("Pruned {total} answer(s)", total=total)
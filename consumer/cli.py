@@ -1,14 +1,86 @@
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, NamedTuple
 
 import typer
+from typer.core import TyperCommand, TyperGroup
+from typer.main import get_group
+
+if TYPE_CHECKING:
+    import click
+
+
+class LazyCommand(NamedTuple):
+    """Subcommand of a Typer app that gets imported only once it's invoked."""
+
+    app_path: str
+    help: str
+
+    def load(self, name: str, ctx: click.Context) -> click.Command | None:
+        module_name, app_name = self.app_path.split(":")
+        sub_app: typer.Typer = getattr(importlib.import_module(module_name), app_name)
+        return get_group(sub_app).get_command(ctx, name)
+
 
-from consumer.settings import configure_logfire
+# Every command is imported on demand, so that it only pays for what it uses
+LAZY_COMMANDS = {
+    "activity": LazyCommand(
+        "consumer.activity:cli",
+        "Print the choice distribution and answer rates backfilled from storage.",
+    ),
+    "aggregate": LazyCommand(
+        "consumer.aggregate:cli",
+        "Merge statistics deltas published by every consumer into a global view.",
+    ),
+    "close": LazyCommand(
+        "consumer.quiz:cli", "Close a question, rejecting later answers to it."
+    ),
+    "export": LazyCommand(
+        "consumer.export:cli",
+        "Stream saved answers with their questions into a Parquet, Arrow or CSV file.",
+    ),
+    "open": LazyCommand(
+        "consumer.quiz:cli", "Open a question, scoring answers by their speed."
+    ),
+    "prune": LazyCommand("consumer.storage:cli", "Delete all saved answers."),
+}
 
-app = typer.Typer(name="mqtt-consumer", no_args_is_help=True)
+
+class LazyGroup(TyperGroup):
+    listing_commands = False
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted({*super().list_commands(ctx), *LAZY_COMMANDS})
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        lazy_command = LAZY_COMMANDS.get(cmd_name)
+        if lazy_command is None or cmd_name in self.commands:
+            return super().get_command(ctx, cmd_name)
+        if self.listing_commands:
+            return TyperCommand(name=cmd_name, help=lazy_command.help)
+        command = lazy_command.load(cmd_name, ctx)
+        if command is not None:
+            self.commands[cmd_name] = command
+        return command
+
+    def format_help(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        self.listing_commands = True
+        try:
+            super().format_help(ctx, formatter)
+        finally:
+            self.listing_commands = False
+
+
+app = typer.Typer(name="mqtt-consumer", no_args_is_help=True, cls=LazyGroup)
 
 
 @app.callback(invoke_without_command=True)
 def callback(ctx: typer.Context) -> None:
     if ctx.invoked_subcommand:
+        # Deferred, it pulls in logfire and the settings
+        from consumer.settings import configure_logfire  # noqa: PLC0415
+
         configure_logfire()
 
 
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+from collections.abc import Sequence
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Annotated, Any, Literal, NamedTuple, Protocol, cast
+
+import logfire
+import typer
+
+from consumer.answers import as_utc
+from consumer.questions import Questions, read_questions_from_file
+from consumer.settings import Settings
+from consumer.storage import Storage, open_storage
+
+if TYPE_CHECKING:
+    from consumer.answers import Answer, Choices
+
+cli = typer.Typer()
+
+type ExportFormat = Literal["parquet", "arrow", "csv"]
+type Row = tuple[Any, ...]
+
+EXPORT_FORMATS: dict[str, ExportFormat] = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".csv": "csv",
+}
+# Every answer joined with the question it answers
+COLUMNS = (
+    "received_at",
+    "device_id",
+    "question_id",
+    "choice",
+    "correct",
+    "answer",
+    "question",
+)
+
+
+def to_row(answer: Answer, questions: Questions) -> Row:
+    received_at = answer.received_at
+    question = questions.get(answer.question_id)
+    if question is None:
+        return (
+            received_at,
+            answer.device_id,
+            answer.question_id,
+            answer.choice,
+            None,
+            None,
+            None,
+        )
+    return (
+        received_at,
+        answer.device_id,
+        answer.question_id,
+        answer.choice,
+        answer.choice == question.answers.correct[0],
+        question.answers.choices.get(cast("Choices", answer.choice)),
+        question.content,
+    )
+
+
+class AnswerWriter(Protocol):
+    path: Path
+
+    def write(self, rows: Sequence[Row]) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class CSVWriter:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.file = path.open("w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows: Sequence[Row]) -> None:
+        self.writer.writerows(rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ArrowWriter:
+    """Record batches written to Parquet or to an Arrow IPC file as they come."""
+
+    def __init__(self, path: Path, export_format: ExportFormat) -> None:
+        # Deferred, pyarrow is an optional dependency (the `export` extra)
+        import pyarrow as pa  # type: ignore[import-untyped]  # noqa: PLC0415
+        import pyarrow.parquet as pq  # type: ignore[import-untyped]  # noqa: PLC0415
+
+        self.pa = pa
+        self.path = path
+        self.schema = pa.schema(
+            [
+                ("received_at", pa.timestamp("us", tz="UTC")),
+                ("device_id", pa.string()),
+                ("question_id", pa.string()),
+                ("choice", pa.uint8()),
+                ("correct", pa.bool_()),
+                ("answer", pa.string()),
+                ("question", pa.string()),
+            ]
+        )
+        self.writer = (
+            pq.ParquetWriter(path, self.schema)
+            if export_format == "parquet"
+            else pa.ipc.new_file(path, self.schema)
+        )
+
+    def write(self, rows: Sequence[Row]) -> None:
+        pa = self.pa
+        self.writer.write_batch(
+            pa.record_batch(
+                [
+                    pa.array(column, type=field.type)
+                    for column, field in zip(
+                        zip(*rows, strict=True), self.schema, strict=True
+                    )
+                ],
+                schema=self.schema,
+            )
+        )
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def open_writer(path: Path) -> AnswerWriter:
+    export_format = EXPORT_FORMATS.get(path.suffix)
+    if export_format is None:
+        msg = f"unsupported export format {path.suffix!r}, use {list(EXPORT_FORMATS)}"
+        raise ValueError(msg)
+    if export_format == "csv":
+        return CSVWriter(path)
+    try:
+        return ArrowWriter(path, export_format)
+    except ImportError:
+        fallback = path.with_suffix(".csv")
+        logfire.warning(
+            "pyarrow is not installed, exporting to {fallback} instead of {path}",
+            fallback=fallback,
+            path=path,
+        )
+        return CSVWriter(fallback)
+
+
+class Exported(NamedTuple):
+    path: Path
+    total: int
+    last_received_at: datetime | None
+
+
+async def export_answers(  # noqa: PLR0913
+    storage: Storage,
+    questions: Questions,
+    output: Path,
+    *,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    chunk_size: int = 10_000,
+) -> Exported:
+    """Stream answers received after `since` up to `until` into a columnar file."""
+    writer = await asyncio.to_thread(open_writer, output)
+    total = 0
+    last_received_at = None
+    try:
+        async for answers in storage.stream_answers(
+            since=since and as_utc(since),
+            until=until and as_utc(until),
+            chunk_size=chunk_size,
+        ):
+            rows = [to_row(answer, questions) for answer in answers]
+            await asyncio.to_thread(writer.write, rows)
+            total += len(rows)
+            last_received_at = rows[-1][0]
+    finally:
+        await asyncio.to_thread(writer.close)
+    return Exported(writer.path, total, last_received_at)
+
+
+def read_watermark(path: Path) -> datetime | None:
+    if not path.exists():
+        return None
+    return datetime.fromisoformat(json.loads(path.read_text())["received_at"])
+
+
+def write_watermark(path: Path, received_at: datetime) -> None:
+    path.write_text(json.dumps({"received_at": received_at.isoformat()}))
+
+
+async def export_incrementally(  # noqa: PLR0913
+    storage: Storage,
+    questions: Questions,
+    output: Path,
+    *,
+    watermark: Path,
+    lag: timedelta,
+    chunk_size: int = 10_000,
+    now: datetime | None = None,
+) -> Exported:
+    """
+    Export the answers received since the previous run, up to `lag` ago.
+
+    An answer may be committed a while after it's stamped, by a slower batch
+    or a writer with a skewed clock. Stopping at `lag` ago, not at the last
+    exported answer, leaves it in the next run as long as it's late by less.
+    """
+    since = await asyncio.to_thread(read_watermark, watermark)
+    until = (now or datetime.now(UTC)) - lag
+    if since is not None:
+        # Never move back, should the lag grow between runs
+        until = max(since, until)
+    exported = await export_answers(
+        storage, questions, output, since=since, until=until, chunk_size=chunk_size
+    )
+    await asyncio.to_thread(write_watermark, watermark, until)
+    return exported
+
+
+async def export_from_storage(  # noqa: PLR0913
+    settings: Settings,
+    questions: Questions,
+    output: Path,
+    *,
+    since: datetime | None,
+    until: datetime | None,
+    incremental: bool,
+) -> Exported:
+    async with open_storage(settings) as storage:
+        if incremental:
+            return await export_incrementally(
+                storage,
+                questions,
+                output,
+                watermark=settings.export_watermark,
+                lag=timedelta(seconds=settings.export_lag),
+                chunk_size=settings.export_chunk_size,
+            )
+        return await export_answers(
+            storage,
+            questions,
+            output,
+            since=since,
+            until=until,
+            chunk_size=settings.export_chunk_size,
+        )
+
+
+@cli.command("export")
+def command_export(
+    questions_file: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    output: Annotated[
+        Path,
+        typer.Argument(
+            dir_okay=False,
+            help="A .parquet, .arrow or .csv file. Without pyarrow, always CSV.",
+        ),
+    ],
+    *,
+    since: Annotated[
+        datetime | None,
+        typer.Option(help="Only answers received after this time (UTC)."),
+    ] = None,
+    until: Annotated[
+        datetime | None,
+        typer.Option(help="Only answers received up to this time (UTC)."),
+    ] = None,
+    incremental: Annotated[
+        bool,
+        typer.Option(
+            help="Export the answers received since the previous --incremental "
+            "run, remembered in SUBSCRIBER_EXPORT_WATERMARK, up to "
+            "SUBSCRIBER_EXPORT_LAG seconds ago. Overrides --since and --until."
+        ),
+    ] = False,
+) -> None:
+    settings = Settings()
+    questions = read_questions_from_file(questions_file)
+    exported = asyncio.run(
+        export_from_storage(
+            settings,
+            questions,
+            output,
+            since=since,
+            until=until,
+            incremental=incremental,
+        )
+    )
+    logfire.info(
+        "Exported {total} answer(s) to {path}",
+        total=exported.total,
+        path=exported.path,
+    )
@@ -1,37 +1,108 @@
 import asyncio
+import signal
 from collections.abc import Callable, Coroutine
+from pathlib import Path
 from typing import Any
 
 import aiomqtt
 import logfire
-from sqlalchemy.ext.asyncio import AsyncEngine
 
-from consumer.settings import Settings, get_db, get_mqtt_client
+from consumer.admission import AdmissionControl
+from consumer.aggregate import publishing_deltas
+from consumer.profiling import capture_profile, stage
+from consumer.settings import Settings, get_mqtt_client
+from consumer.storage import BatchingStorage, Storage, open_storage
 from consumer.utils import get_message_payload
 
-type DatabaseEngine = AsyncEngine
-type Callback = Callable[[aiomqtt.Message, AsyncEngine], Coroutine[Any, Any, Any]]
+type Callback = Callable[[aiomqtt.Message, Storage], Coroutine[Any, Any, Any]]
+type ShutdownHook = Callable[[], Coroutine[Any, Any, Any]]
 
 
 async def consume_message(
     *,
     callback: Callback,
     message: aiomqtt.Message,
-    db: AsyncEngine,
+    storage: Storage,
     tasks: asyncio.TaskGroup,
+    admission: AdmissionControl | None = None,
 ) -> None:
-    tasks.create_task(callback(message, db))
+    # Shed floods before decoding, validating or even logging the message
+    if admission is not None and not admission.admit_message(message):
+        return
+    tasks.create_task(callback(message, storage))
     logfire.info("Processing {message}", message=get_message_payload(message))
     await asyncio.sleep(0)
 
 
-async def consume_messages(
+async def read_messages(
     *,
+    client: aiomqtt.Client,
     callback: Callback,
-    db: AsyncEngine,
+    storage: Storage,
+    tasks: asyncio.TaskGroup,
+    admission: AdmissionControl | None = None,
+) -> None:
+    with stage("receive"):
+        async for message in client.messages:
+            await consume_message(
+                callback=callback,
+                message=message,
+                storage=storage,
+                tasks=tasks,
+                admission=admission,
+            )
+
+
+async def stop_reading(  # noqa: PLR0913
+    *,
+    client: aiomqtt.Client,
+    reader: asyncio.Task[None],
+    callback: Callback,
+    storage: Storage,
+    tasks: asyncio.TaskGroup,
+    topics: list[str],
+    admission: AdmissionControl | None = None,
+) -> None:
+    reader.cancel()
+    await asyncio.wait([reader])
+    for topic in topics:
+        try:
+            await client.unsubscribe(topic)
+        except aiomqtt.MqttError:
+            # Best-effort, the work in flight still drains without the broker
+            logfire.exception("Failed to unsubscribe from `{topic}`", topic=topic)
+            return
+        logfire.info("Unsubscribed from `{topic}`", topic=topic)
+
+    # Messages queued before unsubscribing were already acknowledged to the broker
+    for _ in range(len(client.messages)):
+        await consume_message(
+            callback=callback,
+            message=await anext(client.messages),
+            storage=storage,
+            tasks=tasks,
+            admission=admission,
+        )
+
+
+async def consume_messages(  # noqa: PLR0913
+    *,
+    callback: Callback,
+    storage: Storage,
     settings: Settings,
     topics: list[str],
+    stopping: asyncio.Event,
+    on_shutdown: ShutdownHook | None = None,
+    admission: AdmissionControl | None = None,
 ) -> None:
+    """
+    Consume messages until `stopping` is set, then drain them gracefully.
+
+    Draining stops reading new messages, unsubscribes, waits for the callbacks
+    in flight and runs `on_shutdown` before disconnecting, all within
+    `settings.shutdown_deadline` seconds. Unsubscribing is best-effort, should
+    the broker be gone, the callbacks in flight and `on_shutdown` still run.
+    """
     try:
         async with get_mqtt_client(settings.mqtt) as client:
             logfire.info("Connected to {mqtt}", mqtt=settings.mqtt)
@@ -39,14 +110,60 @@ async def consume_messages(
                 await client.subscribe(topic)
                 logfire.info("Subscribed to `{topic}`", topic=topic)
 
-            async with asyncio.TaskGroup() as tasks:
-                async for message in client.messages:
-                    await consume_message(
-                        callback=callback,
-                        message=message,
-                        db=db,
-                        tasks=tasks,
+            try:
+                async with (
+                    asyncio.timeout(None) as deadline,
+                    asyncio.TaskGroup() as tasks,
+                ):
+                    reader = asyncio.create_task(
+                        read_messages(
+                            client=client,
+                            callback=callback,
+                            storage=storage,
+                            tasks=tasks,
+                            admission=admission,
+                        )
                     )
+                    stopped = asyncio.create_task(stopping.wait())
+                    try:
+                        await asyncio.wait(
+                            [reader, stopped],
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                    finally:
+                        stopped.cancel()
+                        if not reader.done():
+                            reader.cancel()
+                    if stopping.is_set():
+                        logfire.info(
+                            "Shutting down within {deadline}s",
+                            deadline=settings.shutdown_deadline,
+                        )
+                        deadline.reschedule(
+                            asyncio.get_running_loop().time()
+                            + settings.shutdown_deadline
+                        )
+                        await stop_reading(
+                            client=client,
+                            reader=reader,
+                            callback=callback,
+                            storage=storage,
+                            tasks=tasks,
+                            topics=topics,
+                            admission=admission,
+                        )
+                # Callbacks in flight finished, a lost connection can surface now
+                if not reader.cancelled():
+                    reader.result()
+                if stopping.is_set() and on_shutdown is not None:
+                    async with asyncio.timeout_at(deadline.when()):
+                        await on_shutdown()
+            except TimeoutError:
+                logfire.error(
+                    "Shutdown exceeded the deadline of {deadline}s, "
+                    "answers in flight may be lost",
+                    deadline=settings.shutdown_deadline,
+                )
     except aiomqtt.MqttError as error:
         logfire.exception("Lost connection to the broker. Please restart the consumer")
         raise asyncio.CancelledError from error
@@ -57,15 +174,62 @@ async def loop_consume_messages(
     callback: Callback,
     settings: Settings,
     topics: list[str],
+    on_shutdown: ShutdownHook | None = None,
+    profile: bool = False,
 ) -> None:
-    async with get_db(settings.db_path) as db:
-        try:
-            while True:
-                await consume_messages(
-                    callback=callback,
-                    db=db,
-                    settings=settings,
-                    topics=topics,
-                )
-        except asyncio.CancelledError:
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    admission = AdmissionControl.from_settings(settings)
+    profiling: set[asyncio.Task[Path]] = set()
+
+    def start_profiling() -> None:
+        if profiling:
+            logfire.warn("Already profiling, ignoring the request")
             return
+        task = loop.create_task(
+            capture_profile(
+                duration=settings.profile_window,
+                interval=settings.profile_interval,
+                directory=settings.profile_dir,
+                max_tasks=settings.profile_max_tasks,
+            )
+        )
+        profiling.add(task)
+        task.add_done_callback(profiling.discard)
+
+    # Container runtimes ask to stop with SIGTERM before killing the process
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    # Profile a live consumer on demand, with `kill -USR1 <pid>`
+    loop.add_signal_handler(signal.SIGUSR1, start_profiling)
+    if profile:
+        start_profiling()
+    try:
+        async with open_storage(settings) as backend:
+            batching = BatchingStorage(
+                backend, max_batch_size=settings.storage_batch_size
+            )
+
+            async def flush_and_shut_down() -> None:
+                await batching.flush()
+                if on_shutdown is not None:
+                    await on_shutdown()
+
+            async with publishing_deltas(batching, settings) as storage:
+                try:
+                    while not stopping.is_set():
+                        await consume_messages(
+                            callback=callback,
+                            storage=storage,
+                            settings=settings,
+                            topics=topics,
+                            stopping=stopping,
+                            on_shutdown=flush_and_shut_down,
+                            admission=admission,
+                        )
+                except asyncio.CancelledError:
+                    return
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        loop.remove_signal_handler(signal.SIGUSR1)
+        for task in profiling:
+            task.cancel()
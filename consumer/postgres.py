@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+from collections.abc import AsyncGenerator, Sequence
+from contextlib import asynccontextmanager
+from datetime import datetime
+from operator import attrgetter
+from typing import Self
+
+import asyncpg  # type: ignore[import-untyped]
+from pydantic_extra_types.mac_address import MacAddress
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable, ExecutableDDLElement
+from sqlmodel import SQLModel
+
+from consumer.answers import (
+    FIRST_WINS,
+    Answer,
+    ConflictPolicy,
+    DeletedTotal,
+    DeviceID,
+    int_to_mac,
+    mac_to_int,
+    stamp_answers,
+)
+
+# Batches at least this large go through COPY instead of a multi-row INSERT
+COPY_THRESHOLD = 1000
+
+
+def create_schema() -> str:
+    """Render the tables Alembic migrates on SQLite as PostgreSQL DDL."""
+    dialect = postgresql.dialect()  # type: ignore[no-untyped-call]
+    statements: list[ExecutableDDLElement] = []
+    for table in SQLModel.metadata.sorted_tables:
+        statements.append(CreateTable(table, if_not_exists=True))
+        statements.extend(
+            CreateIndex(index, if_not_exists=True)  # type: ignore[no-untyped-call]
+            for index in sorted(table.indexes, key=attrgetter("name"))
+        )
+    return "".join(
+        f"{statement.compile(dialect=dialect)};\n" for statement in statements
+    )
+
+
+SCHEMA = create_schema()
+
+INTERN_QUESTIONS = """
+INSERT INTO questions (external_id) SELECT unnest($1::text[])
+ON CONFLICT DO NOTHING
+"""
+SELECT_QUESTION_KEYS = """
+SELECT external_id, id FROM questions WHERE external_id = ANY($1::text[])
+"""
+ON_CONFLICT_KEEP_FIRST = "ON CONFLICT DO NOTHING"
+# Never let an older answer replace a newer one
+ON_CONFLICT_KEEP_LAST = """
+ON CONFLICT (device_id, question_id) DO UPDATE
+SET choice = excluded.choice, received_at = excluded.received_at
+WHERE excluded.received_at >= answers.received_at
+"""
+INSERT_ANSWERS = """
+INSERT INTO answers (received_at, device_id, question_id, choice)
+SELECT * FROM unnest($1::timestamptz[], $2::bigint[], $3::integer[], $4::integer[])
+{on_conflict}
+RETURNING device_id, question_id
+"""
+CREATE_STAGING = """
+CREATE TEMPORARY TABLE answers_staging
+(LIKE answers INCLUDING DEFAULTS) ON COMMIT DROP
+"""
+INSERT_STAGED_ANSWERS = """
+INSERT INTO answers (received_at, device_id, question_id, choice)
+SELECT received_at, device_id, question_id, choice FROM answers_staging
+{on_conflict}
+RETURNING device_id, question_id
+"""
+
+# NULL bounds leave the range open on that side
+SELECT_ANSWERS_RANGE = """
+SELECT received_at, device_id, external_id, choice
+FROM answers JOIN questions ON questions.id = answers.question_id
+WHERE ($1::timestamptz IS NULL OR received_at > $1)
+AND ($2::timestamptz IS NULL OR received_at <= $2)
+ORDER BY received_at
+"""
+
+
+class PostgresStorage:
+    """Storage on PostgreSQL, ingesting batches with multi-row INSERT or COPY."""
+
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        self.pool = pool
+
+    @classmethod
+    @asynccontextmanager
+    async def connect(cls, dsn: str) -> AsyncGenerator[Self]:
+        async with asyncpg.create_pool(dsn) as pool:
+            async with pool.acquire() as connection:
+                await connection.execute(SCHEMA)
+            yield cls(pool)
+
+    async def save_answers(
+        self,
+        answers: Sequence[Answer],
+        policy: ConflictPolicy = FIRST_WINS,
+    ) -> list[Answer]:
+        # Duplicates would make one statement update the same row twice, an error
+        answers = policy.resolve(stamp_answers(answers))
+        if not answers:
+            return []
+        on_conflict = (
+            ON_CONFLICT_KEEP_LAST if policy.last_wins else ON_CONFLICT_KEEP_FIRST
+        )
+        question_ids = list({answer.question_id for answer in answers})
+        async with self.pool.acquire() as connection, connection.transaction():
+            await connection.execute(INTERN_QUESTIONS, question_ids)
+            keys = dict(await connection.fetch(SELECT_QUESTION_KEYS, question_ids))
+            records = [
+                (
+                    answer.received_at,
+                    mac_to_int(answer.device_id),
+                    keys[answer.question_id],
+                    answer.choice,
+                )
+                for answer in answers
+            ]
+            if len(records) >= COPY_THRESHOLD:
+                await connection.execute(CREATE_STAGING)
+                await connection.copy_records_to_table(
+                    "answers_staging",
+                    records=records,
+                    columns=["received_at", "device_id", "question_id", "choice"],
+                )
+                kept_rows = await connection.fetch(
+                    INSERT_STAGED_ANSWERS.format(on_conflict=on_conflict)
+                )
+            else:
+                kept_rows = await connection.fetch(
+                    INSERT_ANSWERS.format(on_conflict=on_conflict),
+                    *zip(*records, strict=True),
+                )
+        kept_keys = {tuple(row) for row in kept_rows}
+        return [
+            answer
+            for answer in answers
+            if (mac_to_int(answer.device_id), keys[answer.question_id]) in kept_keys
+        ]
+
+    async def is_answered(self, device_id: DeviceID, question_id: str) -> bool:
+        return bool(
+            await self.pool.fetchval(
+                "SELECT EXISTS (SELECT FROM answers JOIN questions "
+                "ON questions.id = answers.question_id "
+                "WHERE device_id = $1 AND external_id = $2)",
+                mac_to_int(device_id),
+                question_id,
+            )
+        )
+
+    async def load_answers(self) -> Sequence[Answer]:
+        rows = await self.pool.fetch(
+            "SELECT received_at, device_id, external_id, choice "
+            "FROM answers JOIN questions ON questions.id = answers.question_id"
+        )
+        # Rows were validated before they got persisted, skip revalidating them
+        return [
+            Answer.model_construct(
+                received_at=received_at,
+                device_id=MacAddress(int_to_mac(device_id)),
+                question_id=question_id,
+                choice=choice,
+            )
+            for received_at, device_id, question_id, choice in rows
+        ]
+
+    async def stream_answers(
+        self,
+        *,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        chunk_size: int = 10_000,
+    ) -> AsyncGenerator[Sequence[Answer]]:
+        # Server-side cursors only live inside a transaction
+        async with self.pool.acquire() as connection, connection.transaction():
+            cursor = await connection.cursor(SELECT_ANSWERS_RANGE, since, until)
+            while rows := await cursor.fetch(chunk_size):
+                yield [
+                    Answer.model_construct(
+                        received_at=received_at,
+                        device_id=MacAddress(int_to_mac(device_id)),
+                        question_id=question_id,
+                        choice=choice,
+                    )
+                    for received_at, device_id, question_id, choice in rows
+                ]
+
+    async def count_choices(self) -> dict[tuple[str, int], int]:
+        rows = await self.pool.fetch(
+            "SELECT external_id, choice, count(*) "
+            "FROM answers JOIN questions ON questions.id = answers.question_id "
+            "GROUP BY external_id, choice"
+        )
+        return {(question_id, choice): count for question_id, choice, count in rows}
+
+    async def count_answers_per_second(self, window_seconds: int) -> dict[int, int]:
+        rows = await self.pool.fetch(
+            "SELECT extract(epoch FROM date_trunc('second', received_at))::bigint, "
+            "count(*) FROM answers "
+            "WHERE received_at >= CURRENT_TIMESTAMP - make_interval(secs => $1) "
+            "GROUP BY 1",
+            window_seconds,
+        )
+        return dict(rows)
+
+    async def prune(self) -> DeletedTotal:
+        total = await self.pool.fetchval(
+            "WITH deleted AS (DELETE FROM answers RETURNING 1) "
+            "SELECT count(*) FROM deleted"
+        )
+        return DeletedTotal(total)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from collections import Counter
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import UTC, datetime
+from pathlib import Path
+from types import CodeType, CoroutineType, GeneratorType
+from typing import Any
+
+import logfire
+
+# Microseconds, the unit of weights in the folded stacks
+SAMPLE_UNIT = 1_000_000
+BUSY_STACK = "(event loop busy)"
+PROFILER_STACK = "(profiler)"
+
+STAGE: ContextVar[str | None] = ContextVar("stage", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Generator[None]:
+    """Annotate the current task with a pipeline stage, the root of its stacks."""
+    token = STAGE.set(name)
+    try:
+        yield
+    finally:
+        STAGE.reset(token)
+
+
+def frame_name(code: CodeType) -> str:
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def task_stack(task: asyncio.Task[Any]) -> list[str]:
+    """Follow the chain of awaits of a task, from its coroutine to the innermost one."""
+    stack: list[str] = []
+    awaitable: object = task.get_coro()
+    while isinstance(awaitable, CoroutineType | GeneratorType):
+        frame = (
+            awaitable.cr_frame
+            if isinstance(awaitable, CoroutineType)
+            else awaitable.gi_frame
+        )
+        if frame is None:
+            break
+        stack.append(frame_name(frame.f_code))
+        awaitable = (
+            awaitable.cr_await
+            if isinstance(awaitable, CoroutineType)
+            else awaitable.gi_yieldfrom
+        )
+    if awaitable is not None:
+        stack.append(f"<{type(awaitable).__name__}>")
+    if (current_stage := task.get_context().get(STAGE)) is not None:
+        stack.insert(0, f"[{current_stage}]")
+    return stack
+
+
+class AsyncProfiler:
+    """
+    Wall-clock sampler of every task's await chain, running inside the event loop.
+
+    Unlike cProfile, time spent awaiting is attributed to the awaiting stack.
+    Samples are weighted by the time elapsed since the previous one, and the
+    delay beyond the sampling interval is reported as the loop being busy.
+    With more than `max_tasks` tasks, each tick walks a random subset of them
+    with weights scaled up to match, and the time the sampler itself takes is
+    reported apart, as its overhead.
+    """
+
+    def __init__(self, interval: float, max_tasks: int = 1000) -> None:
+        self.interval = interval
+        self.max_tasks = max_tasks
+        self.samples: Counter[str] = Counter()
+
+    def sample(self, elapsed: float) -> None:
+        sampler = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not sampler]
+        weight = round(elapsed * SAMPLE_UNIT)
+        if len(tasks) > self.max_tasks:
+            weight = round(elapsed * SAMPLE_UNIT * len(tasks) / self.max_tasks)
+            tasks = random.sample(tasks, self.max_tasks)
+        for task in tasks:
+            if stack := task_stack(task):
+                self.samples[";".join(stack)] += weight
+
+    async def run(self, duration: float) -> None:
+        loop = asyncio.get_running_loop()
+        started = previous = loop.time()
+        overhead = 0.0
+        while previous - started < duration:
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            elapsed, previous = now - previous, now
+            # The previous sample delayed this one, but it's the profiler's fault
+            if (lag := elapsed - self.interval - overhead) > 0:
+                self.samples[BUSY_STACK] += round(lag * SAMPLE_UNIT)
+            self.sample(elapsed)
+            overhead = loop.time() - now
+            self.samples[PROFILER_STACK] += round(overhead * SAMPLE_UNIT)
+
+    def folded(self) -> str:
+        """Stacks in the folded format read by flamegraph.pl, speedscope and others."""
+        return "".join(
+            f"{stack} {weight}\n" for stack, weight in sorted(self.samples.items())
+        )
+
+
+async def capture_profile(
+    *,
+    duration: float,
+    interval: float,
+    directory: Path,
+    max_tasks: int = 1000,
+) -> Path:
+    profiler = AsyncProfiler(interval, max_tasks)
+    logfire.info("Profiling for {duration}s", duration=duration)
+    await profiler.run(duration)
+    path = directory / f"profile-{datetime.now(UTC):%Y%m%dT%H%M%S}.folded"
+    await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+    await asyncio.to_thread(path.write_text, profiler.folded())
+    logfire.info("Wrote profile to {path}", path=path)
+    return path
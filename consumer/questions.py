@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections.abc import Sequence
 from pathlib import Path
 from typing import TYPE_CHECKING, Self
 
@@ -48,6 +49,31 @@ class Question(BaseModel):
     answers: Answers
 
 
+class QuestionCatalog:
+    """Dense ordinals of the questions, in the order they were defined."""
+
+    __slots__ = ("correct_choices", "ids", "ordinals")
+
+    def __init__(self, ids: Sequence[str], correct_choices: bytes) -> None:
+        self.ids = tuple(ids)
+        self.ordinals = {
+            question_id: ordinal for ordinal, question_id in enumerate(ids)
+        }
+        self.correct_choices = correct_choices
+
+    @classmethod
+    def from_questions(cls, questions: Questions) -> Self:
+        return cls(
+            list(questions),
+            correct_choices=bytes(
+                question.answers.correct[0] for question in questions.values()
+            ),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
 def read_questions_from_file(questions_file: StrPath) -> Questions:
     questions_file_path = Path(questions_file)
     file_contents = yaml.safe_load(questions_file_path.read_text())
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Annotated
+
+import logfire
+import typer
+
+from consumer.scoring import ControlAction
+from consumer.settings import Settings, get_mqtt_client
+
+cli = typer.Typer()
+
+AT_HELP = "When the question opens or closes, now by default."
+
+
+async def publish_control(
+    settings: Settings,
+    action: ControlAction,
+    question_id: str,
+    at: datetime | None,
+) -> None:
+    timestamp = time.time() if at is None else at.timestamp()
+    async with get_mqtt_client(settings.mqtt) as client:
+        await client.publish(
+            settings.control_topic, f"{action}|{question_id}|{timestamp}", qos=1
+        )
+    logfire.info(
+        "Published {action} of question {question_id} at {timestamp}",
+        action=action,
+        question_id=question_id,
+        timestamp=timestamp,
+    )
+
+
+@cli.command("open")
+def command_open(
+    question_id: str,
+    at: Annotated[datetime | None, typer.Option(help=AT_HELP)] = None,
+) -> None:
+    asyncio.run(publish_control(Settings(), "open", question_id, at))
+
+
+@cli.command("close")
+def command_close(
+    question_id: str,
+    at: Annotated[datetime | None, typer.Option(help=AT_HELP)] = None,
+) -> None:
+    asyncio.run(publish_control(Settings(), "close", question_id, at))
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import json
+import math
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, Annotated, Literal, Self
+
+import logfire
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    from consumer.answers import Answer
+    from consumer.questions import Question, QuestionCatalog
+
+type ControlAction = Literal["open", "close"]
+CONTROL_ACTIONS: dict[str, ControlAction] = {"open": "open", "close": "close"}
+
+# Points of one answer are packed into 16 bits per question
+MAX_POINTS = 0xFFFF
+
+
+class ScoringRules(BaseModel):
+    """
+    Points of a correct answer, with a bonus shrinking linearly over the time limit.
+
+    >>> ScoringRules().points(elapsed=0), ScoringRules().points(elapsed=7.5)
+    (1000, 875)
+    >>> ScoringRules().points(elapsed=60), ScoringRules().points(elapsed=None)
+    (500, 500)
+    """
+
+    # Negative points would borrow bits from the points of other questions
+    correct_points: Annotated[int, Field(ge=0)] = 500
+    speed_points: Annotated[int, Field(ge=0)] = 500
+    time_limit: Annotated[float, Field(gt=0)] = 30.0
+
+    def points(self, elapsed: float | None) -> int:
+        speed = 0.0 if elapsed is None else max(0.0, 1 - elapsed / self.time_limit)
+        return min(MAX_POINTS, self.correct_points + round(self.speed_points * speed))
+
+
+class QuizSchedule:
+    """
+    Times when every question opened and closed, in dense arrays by question ordinal.
+
+    Questions that were never opened accept answers at any time, like before
+    there was a schedule, but they don't reward speed.
+    """
+
+    __slots__ = ("catalog", "closed", "opened")
+
+    def __init__(self, catalog: QuestionCatalog) -> None:
+        self.catalog = catalog
+        self.opened = array("d", [math.nan]) * len(catalog)
+        self.closed = array("d", [math.nan]) * len(catalog)
+
+    def update(self, action: ControlAction, question_id: str, at: float) -> bool:
+        ordinal = self.catalog.ordinals.get(question_id)
+        if ordinal is None:
+            return False
+        if action == "open":
+            self.opened[ordinal] = at
+            self.closed[ordinal] = math.nan
+        else:
+            self.closed[ordinal] = at
+        return True
+
+    def accepts(self, question_id: str, at: float) -> bool:
+        r"""
+        Tell whether an answer received at the given time is inside the window.
+
+        >>> from consumer.questions import QuestionCatalog
+        >>> schedule = QuizSchedule(QuestionCatalog(["q"], correct_choices=b"\0"))
+        >>> schedule.accepts("q", 5.0)
+        True
+        >>> schedule.update("open", "q", at=10.0)
+        True
+        >>> schedule.update("close", "q", at=20.0)
+        True
+        >>> [schedule.accepts("q", at) for at in (5.0, 15.0, 25.0)]
+        [False, True, False]
+        """
+        ordinal = self.catalog.ordinals.get(question_id)
+        if ordinal is None:
+            return True
+        # Comparisons with NaN are false, so unset bounds never reject anything
+        return not (at < self.opened[ordinal] or at > self.closed[ordinal])
+
+    def elapsed(self, question_id: str, at: float) -> float | None:
+        ordinal = self.catalog.ordinals.get(question_id)
+        if ordinal is None or math.isnan(opened := self.opened[ordinal]):
+            return None
+        return max(0.0, at - opened)
+
+    def as_dict(self) -> dict[str, dict[str, float]]:
+        return {
+            question_id: {
+                action: times[ordinal]
+                for action, times in (("open", self.opened), ("close", self.closed))
+                if not math.isnan(times[ordinal])
+            }
+            for ordinal, question_id in enumerate(self.catalog.ids)
+            if not math.isnan(self.opened[ordinal])
+        }
+
+    @classmethod
+    def load(cls, catalog: QuestionCatalog, path: Path) -> Self:
+        schedule = cls(catalog)
+        if path.exists():
+            for question_id, times in json.loads(path.read_text()).items():
+                for action, at in times.items():
+                    schedule.update(action, question_id, at)
+        return schedule
+
+    def save(self, path: Path) -> None:
+        path.write_text(json.dumps(self.as_dict(), indent=2))
+
+
+def parse_control(payload: str, now: float) -> tuple[ControlAction, str, float]:
+    """
+    Parse a control message opening or closing a question, now or at a given time.
+
+    >>> parse_control("open|lorem ipsum 501", now=10.0)
+    ('open', 'lorem ipsum 501', 10.0)
+    >>> parse_control("close|lorem|ipsum|1747000000.5", now=10.0)
+    ('close', 'lorem|ipsum', 1747000000.5)
+    >>> parse_control("close|42", now=10.0)
+    ('close', '42', 10.0)
+    """
+    name, _, details = payload.partition("|")
+    action = CONTROL_ACTIONS.get(name)
+    if action is None or not details:
+        msg = "expected control message in format open|close|<question ID>[|<time>]"
+        raise ValueError(msg)
+    question_id, separator, at = details.rpartition("|")
+    if separator:
+        try:
+            return action, question_id, float(at)
+        except ValueError:
+            pass
+    return action, details, now
+
+
+class Scoring:
+    """Points of answers, rewarding correct answers received soon after opening."""
+
+    __slots__ = ("rules", "schedule")
+
+    def __init__(self, rules: ScoringRules, schedule: QuizSchedule) -> None:
+        self.rules = rules
+        self.schedule = schedule
+
+    def within_windows(self, answers: list[Answer]) -> list[Answer]:
+        """Drop stamped answers received while their questions were not open."""
+        accepted = [
+            answer
+            for answer in answers
+            if answer.received_at is None
+            or self.schedule.accepts(answer.question_id, answer.received_at.timestamp())
+        ]
+        if rejected := len(answers) - len(accepted):
+            logfire.info(
+                "Rejected {count} answer(s) outside of the question window",
+                count=rejected,
+            )
+        return accepted
+
+    def points(self, question: Question, answer: Answer) -> int:
+        if answer.choice != question.answers.correct[0]:
+            return 0
+        if answer.received_at is None:
+            return self.rules.points(elapsed=None)
+        elapsed = self.schedule.elapsed(
+            answer.question_id, answer.received_at.timestamp()
+        )
+        return self.rules.points(elapsed)
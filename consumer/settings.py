@@ -2,13 +2,13 @@ from __future__ import annotations
 
 import functools
 import os
+import socket
 import ssl
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import TYPE_CHECKING, Annotated, Literal
 
-import aiomqtt
 import dotenv
 import logfire
 from pydantic import BeforeValidator, SecretStr
@@ -16,7 +16,11 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel import Field
 
+from consumer.answers import FIRST_WINS, ConflictPolicy
+from consumer.scoring import ScoringRules
+
 if TYPE_CHECKING:
+    import aiomqtt
     from _typeshed import StrPath
 
 SUBSCRIBER_ENV_FILE = os.getenv("SUBSCRIBER_ENV_FILE") or ".env"
@@ -52,6 +56,8 @@ def sanitize_db_path(db_path: StrPath | Literal[":memory:"]) -> str:
 
 
 type DBPath = Annotated[str, BeforeValidator(sanitize_db_path)]
+type StorageBackend = Literal["sqlite", "memory", "postgres"]
+type DeltaSink = Literal["none", "mqtt", "spool"]
 
 
 class Settings(
@@ -60,17 +66,75 @@ class Settings(
     env_file=SUBSCRIBER_ENV_FILE,
 ):
     db_path: DBPath = "consumer.db"
+    storage: StorageBackend = "sqlite"
+    postgres_dsn: SecretStr | None = Field(default=None, repr=False)
+    storage_batch_size: int = 500
+    # Topics whose payloads are headerless binary records, see `consumer.wire`
+    binary_topics: list[str] = Field(default_factory=list)
+    # Which answer is kept when a device answers again, overridable per topic filter
+    conflict_policy: ConflictPolicy = FIRST_WINS
+    conflict_policies: dict[str, ConflictPolicy] = Field(default_factory=dict)
+    # Seconds a SIGTERM-triggered shutdown may take before answers in flight are lost
+    shutdown_deadline: float = 10.0
+    # Messages per second (and bursts) admitted from one device and from everyone
+    admission_device_rate: float = 1.0
+    admission_device_burst: float = 5.0
+    admission_global_rate: float = 5000.0
+    admission_max_devices: int = 65_536
+    # Statistics deltas published for `aggregate` to merge across nodes
+    node_id: str = Field(default_factory=socket.gethostname)
+    delta_sink: DeltaSink = "none"
+    delta_topic: str = "consumer/deltas"
+    delta_spool: Path = Path("deltas")
+    delta_interval: float = 5.0
+    # The broker queues deltas for this persistent session while `aggregate` is down
+    aggregator_id: str = "consumer-aggregator"
+    # On-demand profiles of a live consumer, see `consumer.profiling`
+    profile_window: float = 30.0
+    profile_interval: float = 0.01
+    # Tasks walked per sample at most, a random subset of them beyond that
+    profile_max_tasks: int = 1000
+    profile_dir: Path = Path("profiles")
+    # Questions opened and closed through the control topic, scored by speed
+    control_topic: str = "quiz/control"
+    schedule_file: Path = Path("schedule.json")
+    scoring: ScoringRules = Field(default_factory=ScoringRules)
+    # Answers streamed per chunk by `export`, and where it continues from. Answers
+    # committed later than this lag after being stamped are missed by `--incremental`
+    export_chunk_size: int = 10_000
+    export_watermark: Path = Path("export-watermark.json")
+    export_lag: float = 60.0
     mqtt: Annotated[MQTTCredentials, Field(default_factory=MQTTCredentials)]
 
     model_config = SettingsConfigDict(extra="ignore")
 
 
-def get_mqtt_client(mqtt_credentials: MQTTCredentials) -> aiomqtt.Client:
+def get_conflict_policy(settings: Settings, topic: str) -> ConflictPolicy:
+    # Deferred, commands that don't talk to the broker shouldn't pay for importing it
+    import aiomqtt  # noqa: PLC0415
+
+    for topic_filter, policy in settings.conflict_policies.items():
+        if aiomqtt.Topic(topic).matches(topic_filter):
+            return policy
+    return settings.conflict_policy
+
+
+def get_mqtt_client(
+    mqtt_credentials: MQTTCredentials,
+    *,
+    identifier: str | None = None,
+    clean_session: bool | None = None,
+) -> aiomqtt.Client:
+    # Deferred, commands that don't talk to the broker shouldn't pay for importing it
+    import aiomqtt  # noqa: PLC0415
+
     return aiomqtt.Client(
         hostname=mqtt_credentials.hostname,
         port=mqtt_credentials.port,
         username=mqtt_credentials.username,
         password=mqtt_credentials.password.get_secret_value(),
+        identifier=identifier,
+        clean_session=clean_session,
         tls_context=ssl.create_default_context() if mqtt_credentials.use_tls else None,
     )
 
@@ -1,32 +1,76 @@
 from __future__ import annotations
 
 import asyncio
-from collections import defaultdict
-from collections.abc import Generator
-from functools import partial
+import itertools
+import time
+from collections.abc import Generator, Iterator, Mapping, Sequence
+from typing import TYPE_CHECKING, Any, Self
 
-import aiomqtt
 import logfire
-from pydantic import Field
-from pydantic.dataclasses import dataclass as pydantic_dataclass
-from sqlmodel import select
-from sqlmodel.ext.asyncio.session import AsyncSession
-
-from consumer.answers import Answer, DeviceID, save_answer
-from consumer.main import DatabaseEngine
-from consumer.questions import Question, Questions
+from pydantic import GetCoreSchemaHandler, TypeAdapter
+from pydantic_core import core_schema
+from pydantic_extra_types.mac_address import MacAddress
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from consumer.activity import QuizActivity
+from consumer.answers import (
+    FIRST_WINS,
+    Answer,
+    Choices,
+    ConflictPolicy,
+    DeviceID,
+    stamp_answers,
+)
+from consumer.profiling import stage
+from consumer.questions import Question, QuestionCatalog, Questions
+from consumer.scoring import MAX_POINTS, Scoring
+from consumer.storage import SQLiteStorage, Storage, answer_key
 from consumer.utils import get_message_payload
+from consumer.wire import answers_from_message
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    import aiomqtt
 
-type Statistics = dict[DeviceID, DeviceStatistics]
 STATISTICS_LOCK = asyncio.Lock()
+CHOICE_BITS = 2
+CHOICE_MASK = (1 << CHOICE_BITS) - 1
+POINTS_BITS = MAX_POINTS.bit_length()
+# Snapshots copy only the chunks holding changed devices
+SNAPSHOT_CHUNKS = 256
 
 
-@pydantic_dataclass
 class DeviceStatistics:
-    questions: Questions = Field(repr=False, exclude=True)
-    answers: dict[str, Answer] = Field(default_factory=dict, repr=False)
+    """
+    Answers of one device, packed into integers indexed by question ordinal.
 
-    def add_answer(self, question: Question, answer: Answer) -> None:
+    `choices` holds 2 bits per question, `answered` and `correct` are bitsets
+    and `points` holds 16 bits per question, summed up in `score`.
+    """
+
+    __slots__ = (
+        "_serialized",
+        "answered",
+        "catalog",
+        "choices",
+        "correct",
+        "device_id",
+        "points",
+        "score",
+    )
+
+    def __init__(self, catalog: QuestionCatalog, device_id: DeviceID) -> None:
+        self.catalog = catalog
+        self.device_id = device_id
+        self.choices = 0
+        self.answered = 0
+        self.correct = 0
+        self.points = 0
+        self.score = 0
+        self._serialized: dict[str, Any] | None = None
+
+    def add_answer(self, question: Question, answer: Answer, points: int = 0) -> None:
         if question.id != answer.question_id:
             logfire.error(
                 "Statistics: Question {question} isn't related to answer {answer}",
@@ -34,87 +78,359 @@ class DeviceStatistics:
                 answer=answer,
             )
             return
-        existing_answer = self.answers.get(question.id)
+        ordinal = self.catalog.ordinals.get(question.id)
+        if ordinal is None:
+            logfire.error(
+                "Tried to process answer for {question} but it doesn't "
+                "exist in the question context {questions}",
+                question=question,
+                questions=self.catalog.ids,
+            )
+            return
 
-        if existing_answer:
+        bit = 1 << ordinal
+        if self.answered & bit:
             logfire.info(
-                "Statistics: Ignoring existing answer {answer} "
-                "of device ID {device_id}",
+                "Statistics: Replacing the answer of device ID {device_id} "
+                "with {answer}",
                 answer=answer,
+                device_id=self.device_id,
             )
 
-        self.answers[question.id] = answer
+        shift = ordinal * CHOICE_BITS
+        self.choices = self.choices & ~(CHOICE_MASK << shift) | answer.choice << shift
+        self.answered |= bit
+        if answer.choice == self.catalog.correct_choices[ordinal]:
+            self.correct |= bit
+        else:
+            self.correct &= ~bit
+
+        shift = ordinal * POINTS_BITS
+        replaced_points = self.points >> shift & MAX_POINTS
+        self.points = self.points & ~(MAX_POINTS << shift) | points << shift
+        self.score += points - replaced_points
+        self._serialized = None
+
+    def copy(self) -> DeviceStatistics:
+        copy = DeviceStatistics(self.catalog, self.device_id)
+        copy.choices = self.choices
+        copy.answered = self.answered
+        copy.correct = self.correct
+        copy.points = self.points
+        copy.score = self.score
+        return copy
+
+    def get_choice(self, ordinal: int) -> Choices | None:
+        if not self.answered >> ordinal & 1:
+            return None
+        return self.choices >> ordinal * CHOICE_BITS & CHOICE_MASK  # type: ignore[return-value]
+
+    @property
+    def answers(self) -> dict[str, Answer]:
+        return dict(self.iter_answers(self.answered))
 
     @property
     def total_answers(self) -> int:
-        return len(self.answers)
+        return self.answered.bit_count()
 
     @property
     def total_correct_answers(self) -> int:
-        return len(dict(self.get_correct_answers()))
+        return self.correct.bit_count()
 
     def get_correct_answers(self) -> Generator[tuple[str, Answer]]:
-        for question_id, answer in self.answers.items():
-            question = self.questions.get(question_id)
-            if question is None:
-                logfire.error(
-                    "Tried to process answer for {question} but it doesn't "
-                    "exist in the question context {questions}",
-                    question=question,
-                    questions=self.questions,
+        yield from self.iter_answers(self.correct)
+
+    def iter_answers(self, bitset: int) -> Generator[tuple[str, Answer]]:
+        for ordinal, question_id in enumerate(self.catalog.ids):
+            if bitset >> ordinal & 1:
+                yield (
+                    question_id,
+                    Answer.model_construct(
+                        received_at=None,
+                        device_id=MacAddress(self.device_id),
+                        question_id=question_id,
+                        choice=self.choices >> ordinal * CHOICE_BITS & CHOICE_MASK,
+                    ),
                 )
-                continue
 
-            if question_id != answer.question_id:
-                # Bad internal path
-                continue
+    def as_dict(self) -> dict[str, Any]:
+        """Serialize the device, cached until its next answer."""
+        if self._serialized is None:
+            answers = {}
+            for ordinal, question_id in enumerate(self.catalog.ids):
+                choice = self.get_choice(ordinal)
+                if choice is not None:
+                    answers[question_id] = {
+                        "device_id": self.device_id,
+                        "question_id": question_id,
+                        "choice": choice,
+                    }
+            self._serialized = {"score": self.score, "answers": answers}
+        return self._serialized
 
-            correct_id, _ = question.answers.correct
-            if correct_id == answer.choice:
-                yield question_id, answer
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls,
+        source_type: Any,
+        handler: GetCoreSchemaHandler,
+    ) -> core_schema.CoreSchema:
+        return core_schema.is_instance_schema(
+            cls,
+            serialization=core_schema.plain_serializer_function_ser_schema(cls.as_dict),
+        )
 
     def __repr__(self) -> str:
+        score = self.score
         total_correct_answers = self.total_correct_answers
         total_answers = self.total_answers
-        return f"{type(self).__name__}({total_correct_answers=}, {total_answers=})"
+        return (
+            f"{type(self).__name__}({score=}, {total_correct_answers=}, "
+            f"{total_answers=})"
+        )
+
+
+def chunk_index(device_id: DeviceID) -> int:
+    return hash(device_id) % SNAPSHOT_CHUNKS
+
+
+class SnapshotChunk(dict[DeviceID, DeviceStatistics]):
+    """Devices of one chunk, never changed once a snapshot holds it."""
+
+    __slots__ = ("_serialized",)
+
+    def __init__(
+        self, devices: Mapping[DeviceID, DeviceStatistics] | None = None
+    ) -> None:
+        super().__init__(devices or {})
+        self._serialized: dict[DeviceID, dict[str, Any]] | None = None
+
+    def as_dict(self) -> dict[DeviceID, dict[str, Any]]:
+        if self._serialized is None:
+            self._serialized = {
+                device_id: device_statistics.as_dict()
+                for device_id, device_statistics in self.items()
+            }
+        return self._serialized
+
+
+EMPTY_CHUNKS = (SnapshotChunk(),) * SNAPSHOT_CHUNKS
+
+
+class StatisticsSnapshot(Mapping[DeviceID, DeviceStatistics]):
+    """
+    Immutable statistics of every device as of one version, safe to read anytime.
+
+    Devices are split into chunks by hash. Consecutive snapshots share the
+    chunks, device copies and their serialized forms that didn't change
+    between them.
+    """
 
+    __slots__ = ("_len", "_serialized", "chunks", "taken_at", "version")
 
-async def update_stats(
+    def __init__(self, chunks: tuple[SnapshotChunk, ...], version: int) -> None:
+        self.chunks = chunks
+        self.version = version
+        self.taken_at = time.monotonic()
+        self._len = sum(map(len, chunks))
+        self._serialized: dict[DeviceID, dict[str, Any]] | None = None
+
+    @property
+    def age(self) -> float:
+        """Seconds since the snapshot was taken."""
+        return time.monotonic() - self.taken_at
+
+    def __getitem__(self, device_id: DeviceID) -> DeviceStatistics:
+        return self.chunks[chunk_index(device_id)][device_id]
+
+    def __iter__(self) -> Iterator[DeviceID]:
+        return itertools.chain.from_iterable(self.chunks)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def as_dict(self) -> dict[DeviceID, dict[str, Any]]:
+        if self._serialized is None:
+            self._serialized = {}
+            for chunk in self.chunks:
+                self._serialized.update(chunk.as_dict())
+        return self._serialized
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls,
+        source_type: Any,
+        handler: GetCoreSchemaHandler,
+    ) -> core_schema.CoreSchema:
+        return core_schema.is_instance_schema(
+            cls,
+            serialization=core_schema.plain_serializer_function_ser_schema(cls.as_dict),
+        )
+
+    def __repr__(self) -> str:
+        version = self.version
+        devices = len(self)
+        return f"{type(self).__name__}({version=}, {devices=})"
+
+
+class Statistics(dict[DeviceID, DeviceStatistics]):
+    """
+    Statistics of every device, created on the first access to each of them.
+
+    Answers added through `add_answer` bump the version, so that `snapshot`
+    knows which devices to copy.
+    """
+
+    __slots__ = ("_changed", "_snapshot", "catalog", "scoring", "version")
+
+    def __init__(
+        self,
+        catalog: QuestionCatalog,
+        scoring: Scoring | None = None,
+    ) -> None:
+        super().__init__()
+        self.catalog = catalog
+        self.scoring = scoring
+        self.version = 0
+        self._changed: set[DeviceID] = set()
+        self._snapshot = StatisticsSnapshot(EMPTY_CHUNKS, self.version)
+
+    @classmethod
+    def from_questions(
+        cls, questions: Questions, scoring: Scoring | None = None
+    ) -> Self:
+        return cls(QuestionCatalog.from_questions(questions), scoring)
+
+    def __missing__(self, device_id: DeviceID) -> DeviceStatistics:
+        device_statistics = self[device_id] = DeviceStatistics(self.catalog, device_id)
+        return device_statistics
+
+    def get_choice(self, device_id: DeviceID, question_id: str) -> Choices | None:
+        ordinal = self.catalog.ordinals.get(question_id)
+        device_statistics = self.get(device_id)
+        if ordinal is None or device_statistics is None:
+            return None
+        return device_statistics.get_choice(ordinal)
+
+    def add_answer(self, question: Question, answer: Answer) -> None:
+        points = self.scoring.points(question, answer) if self.scoring else 0
+        self[answer.device_id].add_answer(question, answer, points)
+        self.version += 1
+        self._changed.add(answer.device_id)
+
+    def snapshot(self) -> StatisticsSnapshot:
+        """
+        Take a snapshot of the current version, copying only what changed.
+
+        That is, the changed devices and the chunks holding them.
+
+        It never awaits, so readers don't need `STATISTICS_LOCK` and writers
+        never wait for them. Without changes, the previous snapshot is returned.
+        """
+        previous = self._snapshot
+        if previous.version == self.version:
+            return previous
+        chunks = list(previous.chunks)
+        copied: dict[int, SnapshotChunk] = {}
+        for device_id in self._changed:
+            index = chunk_index(device_id)
+            chunk = copied.get(index)
+            if chunk is None:
+                chunk = copied[index] = chunks[index] = SnapshotChunk(chunks[index])
+            chunk[device_id] = self[device_id].copy()
+        self._changed.clear()
+        self._snapshot = StatisticsSnapshot(tuple(chunks), self.version)
+        return self._snapshot
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls,
+        source_type: Any,
+        handler: GetCoreSchemaHandler,
+    ) -> core_schema.CoreSchema:
+        return core_schema.is_instance_schema(
+            cls,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda statistics: {
+                    device_id: device_statistics.as_dict()
+                    for device_id, device_statistics in statistics.items()
+                }
+            ),
+        )
+
+
+async def update_stats(  # noqa: PLR0913
     statistics: Statistics,
     message: aiomqtt.Message,
-    db: DatabaseEngine,
+    storage: Storage,
     questions: dict[str, Question],
-) -> tuple[Question, Answer] | None:
-    payload = get_message_payload(message)
+    *,
+    activity: QuizActivity | None = None,
+    binary_topics: Sequence[str] = (),
+    policy: ConflictPolicy = FIRST_WINS,
+) -> list[tuple[Question, Answer]]:
     try:
-        answer = Answer.from_message(payload)
+        answers = answers_from_message(message, statistics.catalog, binary_topics)
     except ValueError:
+        payload = get_message_payload(message)
         logfire.exception(f"Ignoring incorrect payload {payload}", payload=payload)
-        return None
+        return []
+
+    # Stamped on arrival, so that both the window and the score use the same time
+    answers = stamp_answers(answers)
+    if statistics.scoring is not None:
+        answers = statistics.scoring.within_windows(answers)
 
-    async with STATISTICS_LOCK:
-        if await save_answer(answer, db):
-            question = questions.get(answer.question_id)
-            if question is None:
+    with stage("save"):
+        kept = await storage.save_answers(answers, policy)
+    if len(kept) < len(answers):
+        kept_keys = {answer_key(answer) for answer in kept}
+        for answer in answers:
+            if answer_key(answer) not in kept_keys:
                 logfire.error(
-                    "Tried to update statistics with answer {answer}, "
-                    "but it points to a question outside of the question context",
+                    "Skipped {answer} (another answer is kept under {policy})",
                     answer=answer,
+                    policy=policy.mode,
                 )
-                return None
+    for answer in kept:
+        logfire.info("Saved {answer}", answer=answer)
+
+    updated: list[tuple[Question, Answer]] = []
+    with stage("statistics"):
+        async with STATISTICS_LOCK:
+            for answer in kept:
+                question = questions.get(answer.question_id)
+                if question is None:
+                    logfire.error(
+                        "Tried to update statistics with answer {answer}, "
+                        "but it points to a question outside of the question context",
+                        answer=answer,
+                    )
+                    continue
+
+                # Read before a last-wins answer replaces it
+                replaced = statistics.get_choice(answer.device_id, question.id)
+                statistics.add_answer(question, answer)
+                if activity is not None:
+                    activity.record(answer, replaced)
+                updated.append((question, answer))
+    return updated
+
 
-            statistics[answer.device_id].add_answer(question, answer)
-            return question, answer
+def write_snapshot(snapshot: StatisticsSnapshot, path: Path) -> None:
+    path.write_bytes(TypeAdapter(StatisticsSnapshot).dump_json(snapshot, indent=2))
 
-    return None
 
+async def stats_from_db(db: AsyncEngine, questions: Questions) -> Statistics:
+    return await stats_from_storage(SQLiteStorage(db), questions)
 
-async def stats_from_db(db: DatabaseEngine, questions: Questions) -> Statistics:
-    async with AsyncSession(db) as session:
-        all_answers_qs = await session.exec(select(Answer))
-        all_answers = all_answers_qs.fetchall()
 
-    statistics: Statistics = defaultdict(partial(DeviceStatistics, questions))
+async def stats_from_storage(
+    storage: Storage,
+    questions: Questions,
+    scoring: Scoring | None = None,
+) -> Statistics:
+    all_answers = await storage.load_answers()
+    statistics = Statistics.from_questions(questions, scoring)
     for answer in all_answers:
         question = questions.get(answer.question_id)
         if question is None:
@@ -124,5 +440,5 @@ async def stats_from_db(db: DatabaseEngine, questions: Questions) -> Statistics:
                 answer=answer,
             )
             continue
-        statistics[answer.device_id].add_answer(question, answer)
-    return dict(statistics)
+        statistics.add_answer(question, answer)
+    return statistics
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+from collections.abc import AsyncGenerator, AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from datetime import datetime
+from operator import attrgetter
+from typing import Protocol
+
+import logfire
+import typer
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from consumer import answers as sqlite
+from consumer.answers import FIRST_WINS, Answer, ConflictPolicy, DeletedTotal, DeviceID
+from consumer.settings import Settings, get_db
+
+cli = typer.Typer()
+
+type AnswerKey = tuple[DeviceID, str]
+type PendingAnswer = tuple[Answer, ConflictPolicy, asyncio.Future[Answer | None]]
+
+
+def answer_key(answer: Answer) -> AnswerKey:
+    return answer.device_id, answer.question_id
+
+
+class Storage(Protocol):
+    async def save_answers(
+        self,
+        answers: Sequence[Answer],
+        policy: ConflictPolicy = FIRST_WINS,
+    ) -> list[Answer]:
+        """Persist a batch of answers and return the ones that were kept."""
+
+    async def is_answered(self, device_id: DeviceID, question_id: str) -> bool: ...
+
+    async def load_answers(self) -> Sequence[Answer]: ...
+
+    def stream_answers(
+        self,
+        *,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        chunk_size: int = 10_000,
+    ) -> AsyncIterator[Sequence[Answer]]:
+        """Yield answers received after `since` up to `until`, oldest first."""
+
+    async def count_choices(self) -> dict[tuple[str, int], int]: ...
+
+    async def count_answers_per_second(self, window_seconds: int) -> dict[int, int]:
+        """Count answers received in every second of the last `window_seconds`."""
+
+    async def prune(self) -> DeletedTotal: ...
+
+
+class SQLiteStorage:
+    def __init__(self, db: AsyncEngine) -> None:
+        self.db = db
+
+    async def save_answers(
+        self,
+        answers: Sequence[Answer],
+        policy: ConflictPolicy = FIRST_WINS,
+    ) -> list[Answer]:
+        return await sqlite.save_answers(answers, self.db, policy)
+
+    async def is_answered(self, device_id: DeviceID, question_id: str) -> bool:
+        return await sqlite.is_answered(self.db, device_id, question_id)
+
+    async def load_answers(self) -> Sequence[Answer]:
+        return await sqlite.load_answers(self.db)
+
+    def stream_answers(
+        self,
+        *,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        chunk_size: int = 10_000,
+    ) -> AsyncIterator[Sequence[Answer]]:
+        return sqlite.stream_answers(
+            self.db, since=since, until=until, chunk_size=chunk_size
+        )
+
+    async def count_choices(self) -> dict[tuple[str, int], int]:
+        return await sqlite.count_choices(self.db)
+
+    async def count_answers_per_second(self, window_seconds: int) -> dict[int, int]:
+        return await sqlite.count_answers_per_second(self.db, window_seconds)
+
+    async def prune(self) -> DeletedTotal:
+        return await sqlite.prune_answers(self.db)
+
+
+class MemoryStorage:
+    """Storage that keeps answers in process memory, meant for tests."""
+
+    def __init__(self) -> None:
+        self.answers: dict[AnswerKey, Answer] = {}
+
+    async def save_answers(
+        self,
+        answers: Sequence[Answer],
+        policy: ConflictPolicy = FIRST_WINS,
+    ) -> list[Answer]:
+        kept: list[Answer] = []
+        for answer in policy.resolve(sqlite.stamp_answers(answers)):
+            key = answer_key(answer)
+            saved = self.answers.get(key)
+            if saved is not None and not (
+                policy.last_wins
+                and saved.received_at
+                and answer.received_at
+                and answer.received_at >= saved.received_at
+            ):
+                continue
+            self.answers[key] = answer
+            kept.append(answer)
+        return kept
+
+    async def is_answered(self, device_id: DeviceID, question_id: str) -> bool:
+        return (device_id, question_id) in self.answers
+
+    async def load_answers(self) -> Sequence[Answer]:
+        return list(self.answers.values())
+
+    async def stream_answers(
+        self,
+        *,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        chunk_size: int = 10_000,
+    ) -> AsyncGenerator[Sequence[Answer]]:
+        answers = sorted(
+            (
+                answer
+                for answer in self.answers.values()
+                if answer.received_at
+                and (since is None or answer.received_at > since)
+                and (until is None or answer.received_at <= until)
+            ),
+            key=attrgetter("received_at"),
+        )
+        for start in range(0, len(answers), chunk_size):
+            yield answers[start : start + chunk_size]
+
+    async def count_choices(self) -> dict[tuple[str, int], int]:
+        return Counter(
+            (answer.question_id, answer.choice) for answer in self.answers.values()
+        )
+
+    async def count_answers_per_second(self, window_seconds: int) -> dict[int, int]:
+        since = time.time() - window_seconds
+        return Counter(
+            second
+            for answer in self.answers.values()
+            if answer.received_at
+            and (second := int(answer.received_at.timestamp())) >= since
+        )
+
+    async def prune(self) -> DeletedTotal:
+        total = len(self.answers)
+        self.answers.clear()
+        return DeletedTotal(total)
+
+
+class BatchingStorage:
+    """
+    Storage wrapper that persists concurrently saved answers in shared batches.
+
+    While one batch is being written, new answers queue up for the next one,
+    so batches grow with the load and a lone answer is written right away.
+    """
+
+    def __init__(self, storage: Storage, max_batch_size: int = 500) -> None:
+        self.storage = storage
+        self.max_batch_size = max_batch_size
+        self._pending: list[PendingAnswer] = []
+        self._writer: asyncio.Task[None] | None = None
+
+    async def save_answers(
+        self,
+        answers: Sequence[Answer],
+        policy: ConflictPolicy = FIRST_WINS,
+    ) -> list[Answer]:
+        loop = asyncio.get_running_loop()
+        futures: list[asyncio.Future[Answer | None]] = []
+        for answer in answers:
+            future = loop.create_future()
+            self._pending.append((answer, policy, future))
+            futures.append(future)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+        return [answer for answer in await asyncio.gather(*futures) if answer]
+
+    async def _write_pending(self) -> None:
+        while self._pending:
+            batch = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            by_policy: dict[ConflictPolicy, list[PendingAnswer]] = {}
+            for pending in batch:
+                by_policy.setdefault(pending[1], []).append(pending)
+            for policy, group in by_policy.items():
+                await self._write_group(policy, group)
+
+    async def _write_group(
+        self,
+        policy: ConflictPolicy,
+        group: list[PendingAnswer],
+    ) -> None:
+        try:
+            kept = await self.storage.save_answers(
+                [answer for answer, _, _ in group], policy
+            )
+        except Exception as error:  # noqa: BLE001
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        kept_by_key = {answer_key(answer): answer for answer in kept}
+        # Of duplicates within the group, the kept one is the first or the last
+        for answer, _, future in reversed(group) if policy.last_wins else group:
+            if not future.done():
+                future.set_result(kept_by_key.pop(answer_key(answer), None))
+
+    async def flush(self) -> None:
+        """Wait until every answer submitted so far is written."""
+        if self._writer is not None:
+            await asyncio.shield(self._writer)
+
+    async def is_answered(self, device_id: DeviceID, question_id: str) -> bool:
+        return await self.storage.is_answered(device_id, question_id)
+
+    async def load_answers(self) -> Sequence[Answer]:
+        return await self.storage.load_answers()
+
+    def stream_answers(
+        self,
+        *,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        chunk_size: int = 10_000,
+    ) -> AsyncIterator[Sequence[Answer]]:
+        return self.storage.stream_answers(
+            since=since, until=until, chunk_size=chunk_size
+        )
+
+    async def count_choices(self) -> dict[tuple[str, int], int]:
+        return await self.storage.count_choices()
+
+    async def count_answers_per_second(self, window_seconds: int) -> dict[int, int]:
+        return await self.storage.count_answers_per_second(window_seconds)
+
+    async def prune(self) -> DeletedTotal:
+        await self.flush()
+        return await self.storage.prune()
+
+
+@asynccontextmanager
+async def open_storage(settings: Settings) -> AsyncGenerator[Storage]:
+    match settings.storage:
+        case "sqlite":
+            async with get_db(settings.db_path) as db:
+                yield SQLiteStorage(db)
+        case "memory":
+            yield MemoryStorage()
+        case "postgres":
+            # asyncpg is an optional dependency (the `postgres` extra)
+            from consumer.postgres import PostgresStorage  # noqa: PLC0415
+
+            if settings.postgres_dsn is None:
+                msg = "SUBSCRIBER_POSTGRES_DSN must be set to use the postgres storage"
+                raise ValueError(msg)
+            dsn = settings.postgres_dsn.get_secret_value()
+            async with PostgresStorage.connect(dsn) as storage:
+                yield storage
+
+
+async def prune_all_answers(*, settings: Settings) -> DeletedTotal:
+    async with open_storage(settings) as storage:
+        return await storage.prune()
+
+
+@cli.command("prune")
+def command_prune() -> None:
+    total = asyncio.run(prune_all_answers(settings=Settings()))
+    logfire.info("Pruned {total} answer(s)", total=total)
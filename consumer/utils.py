@@ -1,9 +1,13 @@
-from typing import Annotated
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Annotated
 
-import aiomqtt
 import logfire
 from pydantic import AfterValidator
 
+if TYPE_CHECKING:
+    import aiomqtt
+
 type StrippedStr = Annotated[str, AfterValidator(str.strip)]
 
 
@@ -30,4 +34,5 @@ def get_message_payload(message: aiomqtt.Message) -> str:
     # `.payload` attribute values in the received messages are always `bytes`
     # TODO(#1): Report `aiomqtt.types.PayloadType` is incorrectly used upstream
     assert isinstance(message.payload, bytes)
-    return message.payload.decode()
+    # Binary payloads are only logged, escape them instead of failing
+    return message.payload.decode(errors="backslashreplace")
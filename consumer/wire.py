@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import struct
+from collections.abc import Sequence
+from typing import TYPE_CHECKING
+
+from pydantic_extra_types.mac_address import MacAddress
+
+from consumer.answers import Answer, mac_to_int
+from consumer.utils import get_message_payload
+
+if TYPE_CHECKING:
+    import aiomqtt
+
+    from consumer.questions import QuestionCatalog
+
+# Compact binary answers for constrained devices: an optional header (the magic
+# byte and a format version) followed by 9-byte records, each with the MAC
+# address, the 16-bit ordinal of the question in the catalog and the choice.
+# Text payloads start with a hexadecimal digit of the MAC address, never MAGIC,
+# but a record may, so payloads on binary topics are always read as records.
+MAGIC = 0xA5
+VERSION = 1
+HEADER = struct.Struct(">BB")
+RECORD = struct.Struct(">6sHB")
+CHOICES_COUNT = 4
+
+
+def encode_answers(
+    answers: Sequence[Answer],
+    catalog: QuestionCatalog,
+    *,
+    header: bool = True,
+) -> bytes:
+    """
+    Encode answers into one binary payload.
+
+    >>> from consumer.questions import QuestionCatalog
+    >>> catalog = QuestionCatalog(["spam", "eggs"], correct_choices=bytes([0, 1]))
+    >>> answer = Answer.from_message("00-B0-D0-63-C2-26|eggs|2")
+    >>> encode_answers([answer], catalog).hex(" ")
+    'a5 01 00 b0 d0 63 c2 26 00 01 02'
+    """
+    records = b"".join(
+        RECORD.pack(
+            mac_to_int(answer.device_id).to_bytes(6),
+            catalog.ordinals[answer.question_id],
+            answer.choice,
+        )
+        for answer in answers
+    )
+    return HEADER.pack(MAGIC, VERSION) + records if header else records
+
+
+def decode_records(records: bytes, catalog: QuestionCatalog) -> list[Answer]:
+    """
+    Decode a batch of headerless records at once.
+
+    >>> from consumer.questions import QuestionCatalog
+    >>> catalog = QuestionCatalog(["spam", "eggs"], correct_choices=bytes([0, 1]))
+    >>> decode_records(bytes.fromhex("00b0d063c226 0001 02"), catalog)
+    [Answer(device_id='00:b0:d0:63:c2:26', question_id='eggs', choice=2)]
+    >>> decode_records(bytes.fromhex("00b0d063c226 0005 02"), catalog)
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown question ordinal 5 or choice 2
+    """
+    if len(records) % RECORD.size:
+        msg = f"expected records of {RECORD.size} bytes, got {len(records)} bytes"
+        raise ValueError(msg)
+    question_ids = catalog.ids
+    answers: list[Answer] = []
+    for device_id, ordinal, choice in RECORD.iter_unpack(records):
+        if ordinal >= len(question_ids) or choice >= CHOICES_COUNT:
+            msg = f"unknown question ordinal {ordinal} or choice {choice}"
+            raise ValueError(msg)
+        # Every field was checked by now, skip revalidating them
+        answers.append(
+            Answer.model_construct(
+                received_at=None,
+                device_id=MacAddress(device_id.hex(":")),
+                question_id=question_ids[ordinal],
+                choice=choice,
+            )
+        )
+    return answers
+
+
+def decode_payload(payload: bytes, catalog: QuestionCatalog) -> list[Answer]:
+    r"""
+    Decode a payload starting with the header.
+
+    >>> from consumer.questions import QuestionCatalog
+    >>> decode_payload(b"\xa5", QuestionCatalog(["spam"], correct_choices=b"\0"))
+    Traceback (most recent call last):
+    ...
+    ValueError: expected a header of 2 bytes, got 1 bytes
+    """
+    if len(payload) < HEADER.size:
+        msg = f"expected a header of {HEADER.size} bytes, got {len(payload)} bytes"
+        raise ValueError(msg)
+    magic, version = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        msg = f"unsupported binary payload header {payload[: HEADER.size].hex()}"
+        raise ValueError(msg)
+    return decode_records(payload[HEADER.size :], catalog)
+
+
+def is_binary(payload: bytes) -> bool:
+    return payload[:1] == bytes([MAGIC])
+
+
+def answers_from_message(
+    message: aiomqtt.Message,
+    catalog: QuestionCatalog,
+    binary_topics: Sequence[str] = (),
+) -> list[Answer]:
+    """Parse a text or binary message, telling them apart by topic or magic byte."""
+    payload = message.payload
+    if isinstance(payload, bytes):
+        if any(message.topic.matches(topic) for topic in binary_topics):
+            return decode_records(payload, catalog)
+        if is_binary(payload):
+            return decode_payload(payload, catalog)
+    return [Answer.from_message(get_message_payload(message))]
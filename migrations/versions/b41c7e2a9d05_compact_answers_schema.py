@@ -0,0 +1,134 @@
+# ruff: noqa: E501,W291
+"""
+Compact answers schema.
+
+Device IDs are stored as 48-bit integers, question IDs are interned into the
+`questions` table and `answers` is clustered on its primary key (WITHOUT ROWID).
+
+Revision ID: b41c7e2a9d05
+Revises: f3e8d884e7fb
+Created: 2025-03-15 19:04:12.518204
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+revision: str = "b41c7e2a9d05"
+down_revision: str | None = "f3e8d884e7fb"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+MAC_ADDRESS_SEPARATORS = str.maketrans("", "", ":-.")
+
+
+def mac_to_int(mac_address: str) -> int:
+    return int.from_bytes(bytes.fromhex(mac_address.translate(MAC_ADDRESS_SEPARATORS)))
+
+
+def int_to_mac(value: int) -> str:
+    return value.to_bytes(6).hex(":")
+
+
+def upgrade() -> None:
+    op.rename_table("answers", "answers_text")
+    questions = op.create_table(
+        "questions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("external_id", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("external_id"),
+    )
+    answers = op.create_table(
+        "answers",
+        sa.Column(
+            "received_at",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.Column("device_id", sa.BigInteger(), nullable=False),
+        sa.Column("question_id", sa.Integer(), nullable=False),
+        sa.Column("choice", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["question_id"], ["questions.id"]),
+        sa.PrimaryKeyConstraint("device_id", "question_id"),
+        sqlite_with_rowid=False,
+    )
+    assert questions is not None
+    assert answers is not None
+
+    connection = op.get_bind()
+    connection.execute(
+        sa.text(
+            "INSERT INTO questions (external_id) "
+            "SELECT DISTINCT question_id FROM answers_text"
+        )
+    )
+    rows = connection.execute(
+        sa.text(
+            "SELECT a.received_at, a.device_id, q.id, a.choice "
+            "FROM answers_text AS a JOIN questions AS q "
+            "ON q.external_id = a.question_id "
+            "ORDER BY a.received_at"
+        ).columns(received_at=sa.TIMESTAMP(timezone=True))
+    ).all()
+    if rows:
+        # Differently spelled MACs of one device collapse into one key: first wins
+        connection.execute(
+            sqlite_insert(answers).on_conflict_do_nothing(),
+            [
+                {
+                    "received_at": received_at,
+                    "device_id": mac_to_int(device_id),
+                    "question_id": question_id,
+                    "choice": choice,
+                }
+                for received_at, device_id, question_id, choice in rows
+            ],
+        )
+    op.drop_table("answers_text")
+
+
+def downgrade() -> None:
+    op.rename_table("answers", "answers_compact")
+    answers = op.create_table(
+        "answers",
+        sa.Column(
+            "received_at",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.Column("device_id", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("question_id", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("choice", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("device_id", "question_id"),
+    )
+    assert answers is not None
+
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.text(
+            "SELECT a.received_at, a.device_id, q.external_id, a.choice "
+            "FROM answers_compact AS a JOIN questions AS q "
+            "ON q.id = a.question_id"
+        ).columns(received_at=sa.TIMESTAMP(timezone=True))
+    ).all()
+    if rows:
+        op.bulk_insert(
+            answers,
+            [
+                {
+                    "received_at": received_at,
+                    "device_id": int_to_mac(device_id),
+                    "question_id": question_id,
+                    "choice": choice,
+                }
+                for received_at, device_id, question_id, choice in rows
+            ],
+        )
+    op.drop_table("answers_compact")
+    op.drop_table("questions")
@@ -1,27 +1,40 @@
 from __future__ import annotations
 
 import asyncio
-import bisect
 import json
-from collections import defaultdict
+import time
+from collections.abc import Callable, Mapping, Sequence
 from datetime import datetime
 from functools import partial
 from itertools import starmap
 from operator import attrgetter
 from pathlib import Path
-from typing import NamedTuple
+from typing import TYPE_CHECKING, Annotated, NamedTuple
 
-import aiomqtt
 import logfire
 import rich
 import typer
 from pydantic import TypeAdapter
 
-from consumer.main import DatabaseEngine, loop_consume_messages
-from consumer.questions import Question, read_questions_from_file
-from consumer.settings import Settings, configure_logfire, get_db
-from consumer.stats import DeviceStatistics, Statistics, stats_from_db, update_stats
-from consumer.utils import should_skip
+from consumer.activity import QuizActivity
+from consumer.answers import FIRST_WINS, ConflictPolicy
+from consumer.profiling import stage
+from consumer.questions import Question, QuestionCatalog, read_questions_from_file
+from consumer.scoring import QuizSchedule, Scoring, parse_control
+from consumer.settings import Settings, configure_logfire, get_conflict_policy
+from consumer.stats import (
+    DeviceStatistics,
+    Statistics,
+    StatisticsSnapshot,
+    stats_from_storage,
+    update_stats,
+    write_snapshot,
+)
+from consumer.storage import Storage, open_storage
+from consumer.utils import get_message_payload, should_skip
+
+if TYPE_CHECKING:
+    import aiomqtt
 
 QUESTIONS_FILE = Path("rustmeet/rustmeet_2025/questions.yml")
 LEADERBOARD_FILE = Path("leaderboard.json")
@@ -37,88 +50,198 @@ class LeaderboardItem(NamedTuple):
     def __str__(self) -> str:
         stats = self.device_statistics
         return (
-            f"{self.device_id} (correct: {stats.total_correct_answers}, "
+            f"{self.device_id} (score: {stats.score}, "
+            f"correct: {stats.total_correct_answers}, "
             f"total answers: {stats.total_answers})"
         )
 
+    @property
+    def rank_key(self) -> tuple[int, int, str]:
+        # Ties on score go to more correct answers, then to the device ID
+        stats = self.device_statistics
+        return stats.score, stats.total_correct_answers, str(self.device_id)
+
+
+def get_leaderboard(
+    statistics: Mapping[str, DeviceStatistics],
+) -> list[LeaderboardItem]:
+    """Rank devices by score, the best one last."""
+    return sorted(
+        starmap(LeaderboardItem, statistics.items()),
+        key=attrgetter("rank_key"),
+    )
 
-def get_leaderboard(statistics: Statistics) -> list[LeaderboardItem]:
-    leaderboard: list[LeaderboardItem] = []
-    for item in starmap(LeaderboardItem, statistics.items()):
-        bisect.insort(
-            leaderboard, item, key=attrgetter("device_statistics.total_correct_answers")
+
+async def on_control(
+    statistics: Statistics,
+    message: aiomqtt.Message,
+    *,
+    schedule_file: Path | None = None,
+) -> None:
+    if statistics.scoring is None:
+        return
+    schedule = statistics.scoring.schedule
+    payload = get_message_payload(message)
+    try:
+        action, question_id, at = parse_control(payload, now=time.time())
+    except ValueError:
+        logfire.exception(f"Ignoring incorrect control {payload}", payload=payload)
+        return
+    if not schedule.update(action, question_id, at):
+        logfire.error(
+            "Ignoring control of unknown question {question_id}",
+            question_id=question_id,
         )
-    return leaderboard
+        return
+    logfire.info(
+        "Question {question_id}: {action} at {at}",
+        question_id=question_id,
+        action=action,
+        at=at,
+    )
+    if schedule_file is not None:
+        await asyncio.to_thread(schedule.save, schedule_file)
 
 
-async def on_message(
+async def on_message(  # noqa: PLR0913
     statistics: Statistics,
     expected_topic: str,
     message: aiomqtt.Message,
-    db: DatabaseEngine,
+    storage: Storage,
     *,
     questions: dict[str, Question],
+    activity: QuizActivity,
+    binary_topics: Sequence[str] = (),
+    get_policy: Callable[[str], ConflictPolicy] | None = None,
+    control_topic: str | None = None,
+    schedule_file: Path | None = None,
 ) -> None:
+    if control_topic is not None and message.topic.matches(control_topic):
+        await on_control(statistics, message, schedule_file=schedule_file)
+        return
     if should_skip(message, expected_topic):
         return
 
+    # Subscription filters may be wider than the topics policies are set for
+    policy = FIRST_WINS if get_policy is None else get_policy(message.topic.value)
     updated = await update_stats(
         statistics,
         message,
-        db,
+        storage,
         questions=questions,
+        activity=activity,
+        binary_topics=binary_topics,
+        policy=policy,
     )
-    if updated is None:
+    if not updated:
         return
 
-    question, answer = updated
+    captured_at = datetime.now().isoformat()  # noqa: DTZ005
+    snapshot = statistics.snapshot()
+    state = TypeAdapter(StatisticsSnapshot).dump_python(snapshot)
+    activity_state = activity.as_dict()
+    events = [
+        {
+            "captured_at": captured_at,
+            "caused_by": (question.model_dump(), answer.model_dump()),
+            "version": snapshot.version,
+            "state": state,
+            "activity": activity_state,
+        }
+        for question, answer in updated
+    ]
 
-    event = {
-        "captured_at": datetime.now().isoformat(),  # noqa: DTZ005
-        "caused_by": (question.model_dump(), answer.model_dump()),
-        "state": TypeAdapter(Statistics).dump_python(statistics),  # type: ignore[arg-type]
-    }
+    for event in events:
+        rich.print(event)
 
-    rich.print(event)
-
-    with EVENTS_FILE.open(mode="a") as events_file:  # noqa: ASYNC230
+    with stage("export"), EVENTS_FILE.open(mode="a") as events_file:  # noqa: ASYNC230
         await asyncio.to_thread(
             events_file.write,
-            json.dumps(event, indent=2, ensure_ascii=False) + "\n",
+            "".join(
+                json.dumps(event, indent=2, ensure_ascii=False) + "\n"
+                for event in events
+            ),
         )
         logfire.info("Wrote event to {events_file}", events_file=EVENTS_FILE)
 
 
-async def main(topic: str = "answer", *, questions: dict[str, Question]) -> None:
-    statistics: Statistics = defaultdict(partial(DeviceStatistics, questions))
+async def write_leaderboard(statistics: Statistics) -> None:
+    # Immutable, so the snapshot can be serialized off the event loop
+    await asyncio.to_thread(write_snapshot, statistics.snapshot(), LEADERBOARD_FILE)
+    logfire.info(
+        "Wrote leaderboard to {leaderboard_file}",
+        leaderboard_file=LEADERBOARD_FILE,
+    )
+
+
+async def main(
+    topic: str = "answer",
+    *,
+    questions: dict[str, Question],
+    profile: bool = False,
+) -> None:
+    # Deferred, only `listen` needs the MQTT client
+    from consumer.main import loop_consume_messages  # noqa: PLC0415
+
+    settings = Settings()
+    catalog = QuestionCatalog.from_questions(questions)
+    schedule = await asyncio.to_thread(
+        QuizSchedule.load, catalog, settings.schedule_file
+    )
+    statistics = Statistics(catalog, Scoring(settings.scoring, schedule))
+    activity = QuizActivity(catalog)
     await loop_consume_messages(
-        callback=partial(on_message, statistics, topic, questions=questions),
-        settings=Settings(),
-        topics=[topic],
+        callback=partial(
+            on_message,
+            statistics,
+            topic,
+            questions=questions,
+            activity=activity,
+            binary_topics=settings.binary_topics,
+            get_policy=partial(get_conflict_policy, settings),
+            control_topic=settings.control_topic,
+            schedule_file=settings.schedule_file,
+        ),
+        settings=settings,
+        topics=[topic, settings.control_topic],
+        on_shutdown=partial(write_leaderboard, statistics),
+        profile=profile,
     )
 
 
 @cli.command("listen")
-def command_listen() -> None:
+def command_listen(
+    *,
+    topic: Annotated[
+        str,
+        typer.Option(help="Topic filter of the answers, e.g. quiz/# for several."),
+    ] = "answer",
+    profile: Annotated[
+        bool,
+        typer.Option(
+            help="Profile the first SUBSCRIBER_PROFILE_WINDOW seconds. "
+            "Send SIGUSR1 to profile later on.",
+        ),
+    ] = False,
+) -> None:
     configure_logfire()
     questions = read_questions_from_file(questions_file=QUESTIONS_FILE)
-    asyncio.run(main(questions=questions))
+    asyncio.run(main(topic, questions=questions, profile=profile))
 
 
 async def leaderboard_from_db(
     settings: Settings,
     questions: dict[str, Question],
 ) -> list[LeaderboardItem]:
-    async with get_db(settings.db_path) as db:
-        stats = await stats_from_db(db, questions)
-        await asyncio.to_thread(
-            LEADERBOARD_FILE.write_bytes,
-            TypeAdapter(Statistics).dump_json(stats, indent=2),  # type: ignore[arg-type]
-        )
-        logfire.info(
-            "Wrote leaderboard to {leaderboard_file}",
-            events_file=LEADERBOARD_FILE,
+    catalog = QuestionCatalog.from_questions(questions)
+    schedule = await asyncio.to_thread(
+        QuizSchedule.load, catalog, settings.schedule_file
+    )
+    async with open_storage(settings) as storage:
+        stats = await stats_from_storage(
+            storage, questions, Scoring(settings.scoring, schedule)
         )
+        await write_leaderboard(stats)
         return get_leaderboard(stats)
 
 
@@ -2,14 +2,16 @@ import os
 from collections.abc import AsyncGenerator
 from pathlib import Path
 
+import aiomqtt
 import logfire as logfire_lib
 import pytest
 import pytest_asyncio
 from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlmodel import SQLModel
 
 from consumer.answers import Answer
+from consumer.questions import Answers, Question, Questions
 from consumer.settings import (
     SUBSCRIBER_ENV_FILE,
     DBPath,
@@ -23,6 +25,13 @@ SUBSCRIBER_TEST_ENV_FILE = os.getenv("SUBSCRIBER_TEST_ENV_FILE") or SUBSCRIBER_E
 SAMPLES_FILE = Path("tests/test-samples.txt")
 
 
+def to_message(payload: Answer | bytes, topic: str = "answer") -> aiomqtt.Message:
+    """Wrap a raw payload, or an answer in the text format, into a message."""
+    if isinstance(payload, Answer):
+        payload = f"{payload.device_id}|{payload.question_id}|{payload.choice}".encode()
+    return aiomqtt.Message(topic, payload, qos=1, retain=False, mid=0, properties=None)
+
+
 class TestSettings(Settings):
     db_path: DBPath = ":memory:"
 
@@ -57,16 +66,36 @@ def populate_test_db(settings: Settings) -> None:
         SQLModel.metadata.create_all(engine)
 
 
+@pytest_asyncio.fixture(loop_scope="function", scope="function")
+async def test_engine(settings: Settings) -> AsyncGenerator[AsyncEngine]:
+    async with get_db(settings.db_path) as test_engine:
+        async with test_engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+        yield test_engine
+
+
 @pytest_asyncio.fixture(autouse=True, loop_scope="function", scope="function")
-async def test_db(settings: Settings) -> AsyncGenerator[AsyncSession]:
-    async with get_db(settings.db_path) as test_db:
-        session = AsyncSession(test_db)
-        try:
-            yield session
-        finally:
-            await session.rollback()
+async def test_db(test_engine: AsyncEngine) -> AsyncGenerator[AsyncSession]:
+    session = AsyncSession(test_engine)
+    try:
+        yield session
+    finally:
+        await session.rollback()
 
 
 @pytest.fixture(scope="session")
 def sample_answers() -> list[Answer]:
     return [*map(Answer.from_message, get_sample_payloads(SAMPLES_FILE))]
+
+
+@pytest.fixture(scope="session")
+def sample_questions(sample_answers: list[Answer]) -> Questions:
+    choices = {0: "foo", 1: "bar", 2: "biz", 3: "baz"}
+    return {
+        answer.question_id: Question(
+            id=answer.question_id,
+            content=answer.question_id,
+            answers=Answers(choices=choices, correct=(0, "foo")),
+        )
+        for answer in sample_answers
+    }
@@ -0,0 +1,73 @@
+from datetime import UTC, datetime
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from consumer.activity import QuizActivity, activity_from_storage
+from consumer.answers import Answer, ConflictPolicy, save_answer
+from consumer.questions import QuestionCatalog, Questions
+from consumer.stats import Statistics, update_stats
+from consumer.storage import SQLiteStorage
+from tests.conftest import to_message
+
+
+def test_choice_distribution_counts_every_choice() -> None:
+    activity = QuizActivity(QuestionCatalog(["F1", "F2"], correct_choices=b"\0\0"))
+    received_at = datetime(2025, 3, 22, 12, tzinfo=UTC)
+    choices = (1, 1, 3)
+    for device, choice in enumerate(choices):
+        activity.record(
+            Answer(
+                received_at=received_at,
+                device_id=f"00:00:00:00:00:{device:02x}",
+                question_id="F2",
+                choice=choice,
+            )
+        )
+    summary = activity.as_dict(now=received_at.timestamp())
+    assert summary["choices"] == {"F1": [0, 0, 0, 0], "F2": [0, 2, 0, 1]}
+    assert summary["answers_per_second"][-1] == len(choices)
+    assert summary["answers_per_minute"][-1] == len(choices)
+
+
+@pytest.mark.asyncio
+async def test_backfill_matches_live_activity(
+    test_engine: AsyncEngine,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    live = QuizActivity(QuestionCatalog.from_questions(sample_questions))
+    for answer in sample_answers:
+        assert await save_answer(answer, test_engine)
+        live.record(answer)
+
+    backfilled = await activity_from_storage(
+        SQLiteStorage(test_engine), sample_questions
+    )
+    assert backfilled.choices.as_dict() == live.choices.as_dict()
+    assert sum(backfilled.per_minute.series()) == len(sample_answers)
+
+
+@pytest.mark.asyncio
+async def test_backfill_matches_live_activity_under_last_wins(
+    test_engine: AsyncEngine,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    storage = SQLiteStorage(test_engine)
+    statistics = Statistics.from_questions(sample_questions)
+    live = QuizActivity(statistics.catalog)
+    answer = sample_answers[0]
+    for choice in (0, 1, 2):
+        await update_stats(
+            statistics,
+            to_message(answer.model_copy(update={"choice": choice})),
+            storage,
+            sample_questions,
+            activity=live,
+            policy=ConflictPolicy(mode="last-wins"),
+        )
+
+    backfilled = await activity_from_storage(storage, sample_questions)
+    assert live.choices.get(answer.question_id) == [0, 0, 1, 0]
+    assert backfilled.choices.as_dict() == live.choices.as_dict()
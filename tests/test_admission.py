@@ -0,0 +1,81 @@
+from consumer.admission import AdmissionControl, record_keys
+from consumer.wire import HEADER, MAGIC, RECORD, VERSION
+from tests.conftest import to_message
+
+DEVICE_BURST = 3
+GLOBAL_RATE = 10
+
+
+def payload(device: int) -> bytes:
+    return f"{device.to_bytes(6).hex(':')}|question|1".encode()
+
+
+def test_flooding_device_does_not_starve_others() -> None:
+    admission = AdmissionControl(
+        device_rate=1, device_burst=DEVICE_BURST, global_rate=1000
+    )
+    flood = [admission.admit(payload(0), now=0) for _ in range(100)]
+    assert flood.count(True) == DEVICE_BURST
+    assert all(admission.admit(payload(device), now=0) for device in range(1, 50))
+    assert admission.shed == {"device": 97}
+
+
+def test_global_rate_caps_all_devices() -> None:
+    admission = AdmissionControl(device_rate=1, device_burst=1, global_rate=GLOBAL_RATE)
+    admitted = [admission.admit(payload(device), now=0) for device in range(30)]
+    assert admitted.count(True) == GLOBAL_RATE
+    assert admission.admit(payload(100), now=0.5)
+    assert admission.shed == {"global": 20}
+
+
+def test_bucket_table_is_bounded() -> None:
+    admission = AdmissionControl(
+        device_rate=1, device_burst=1, global_rate=10_000, max_devices=100
+    )
+    for device in range(1000):
+        admission.admit(payload(device), now=0)
+    assert len(admission.buckets) == admission.max_devices
+    # The least recently seen devices were evicted first
+    assert not admission.admit(payload(999), now=0)
+    assert admission.admit(payload(0), now=0)
+
+
+def test_binary_answers_cost_a_token_each() -> None:
+    admission = AdmissionControl(
+        device_rate=1, device_burst=DEVICE_BURST, global_rate=1000
+    )
+    mac = (0).to_bytes(6)
+    records = b"".join(
+        RECORD.pack(mac, ordinal, ordinal % 4) for ordinal in range(DEVICE_BURST)
+    )
+    assert len(record_keys(records)) == 1
+    assert admission.admit(HEADER.pack(MAGIC, VERSION) + records, now=0)
+    # The text and binary answers of one device share its bucket
+    assert not admission.admit(payload(0), now=0)
+    assert not admission.admit(records[: RECORD.size], now=0, headerless=True)
+    assert admission.admit(payload(1), now=0)
+    assert admission.shed == {"device": 2}
+
+
+def test_headerless_records_starting_with_the_magic_byte() -> None:
+    admission = AdmissionControl(device_rate=1, device_burst=1, global_rate=1000)
+    mac = bytes.fromhex("a54cf3989de2")
+    records = RECORD.pack(mac, 0, 1) + RECORD.pack((1).to_bytes(6), 0, 1)
+    assert admission.admit(records, now=0, headerless=True)
+    assert set(admission.buckets) == {
+        mac.hex().encode(),
+        (1).to_bytes(6).hex().encode(),
+    }
+
+
+def test_control_messages_are_exempt_but_not_on_the_answer_topic() -> None:
+    admission = AdmissionControl(
+        device_rate=0, device_burst=1, global_rate=1000, exempt_topics=["quiz/control"]
+    )
+    control = b"open|question|1"
+    for topic in ("answer", "quiz/control", "quiz/control"):
+        assert admission.admit_message(to_message(control, topic)) == (
+            topic == "quiz/control"
+        )
+    assert admission.shed == {"malformed": 1}
+    assert not admission.buckets
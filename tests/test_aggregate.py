@@ -0,0 +1,132 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from consumer.aggregate import (
+    DeltaRecorder,
+    SpoolSink,
+    aggregate_mqtt,
+    aggregate_spool,
+    publish_delta,
+    receive_delta,
+)
+from consumer.answers import Answer, ConflictPolicy
+from consumer.questions import Questions
+from consumer.settings import Settings
+from consumer.storage import MemoryStorage
+
+
+@pytest.mark.asyncio
+async def test_spooled_deltas_merge_without_double_counting(
+    tmp_path: Path,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    spool = tmp_path / "deltas"
+    sink = SpoolSink(spool)
+    hall_a = DeltaRecorder(MemoryStorage(), node="hall-a")
+    hall_b = DeltaRecorder(MemoryStorage(), node="hall-b")
+
+    # Devices wandering between halls answer some questions at both of them
+    await hall_a.save_answers(sample_answers[:150])
+    await publish_delta(hall_a, sink)
+    await hall_b.save_answers(sample_answers[100:])
+    await publish_delta(hall_b, sink)
+    await hall_a.save_answers(sample_answers[150:200])
+    await publish_delta(hall_a, sink)
+    # Redelivered deltas must not change anything
+    for path in list(spool.iterdir()):
+        shutil.copy(path, spool / f"copy-{path.name}")
+
+    view = await aggregate_spool(
+        spool, sample_questions, tmp_path / "leaderboard.json", interval=None
+    )
+    assert len(view.answers) == len(sample_answers)
+    assert sum(stats.total_answers for stats in view.leaderboard.values()) == len(
+        sample_answers
+    )
+    assert (tmp_path / "leaderboard.json").exists()
+
+
+@pytest.mark.asyncio
+async def test_last_wins_answers_replace_earlier_ones_globally(
+    tmp_path: Path,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    sink = SpoolSink(tmp_path / "deltas")
+    last_wins = ConflictPolicy(mode="last-wins")
+    hall_a = DeltaRecorder(MemoryStorage(), node="hall-a")
+    hall_b = DeltaRecorder(MemoryStorage(), node="hall-b")
+    answer = sample_answers[0]
+    changed = answer.model_copy(update={"choice": (answer.choice + 1) % 4})
+
+    await hall_a.save_answers([answer], last_wins)
+    await hall_b.save_answers([changed], last_wins)
+    # Published out of order, the later answer still wins
+    await publish_delta(hall_b, sink)
+    await publish_delta(hall_a, sink)
+
+    view = await aggregate_spool(
+        sink.directory, sample_questions, tmp_path / "leaderboard.json", interval=None
+    )
+    (device_statistics,) = view.leaderboard.values()
+    assert device_statistics.answers[answer.question_id].choice == changed.choice
+
+
+@pytest.mark.asyncio
+async def test_mqtt_deltas_survive_a_restart(
+    tmp_path: Path,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    spool = SpoolSink(tmp_path / "deltas")
+    output = tmp_path / "leaderboard.json"
+    hall = DeltaRecorder(MemoryStorage(), node="hall")
+    view = await aggregate_spool(
+        spool.directory, sample_questions, output, interval=None
+    )
+
+    await hall.save_answers(sample_answers[:100])
+    first = hall.take_delta()
+    await hall.save_answers(sample_answers[100:])
+    second = hall.take_delta()
+    assert first is not None
+    assert second is not None
+    for delta in (first, second, first):
+        await receive_delta(view, spool, delta.model_dump_json().encode(), output)
+
+    restarted = await aggregate_spool(
+        spool.directory, sample_questions, output, interval=None
+    )
+    assert restarted.answers == view.answers
+    assert restarted.leaderboard.snapshot().as_dict() == (
+        view.leaderboard.snapshot().as_dict()
+    )
+
+
+@pytest.mark.asyncio
+async def test_aggregator_keeps_its_session_while_down(
+    mocker: MockerFixture,
+    tmp_path: Path,
+    settings: Settings,
+    sample_questions: Questions,
+) -> None:
+    client = mocker.AsyncMock()
+    client.__aenter__.return_value = client
+    client.messages.__aiter__.return_value = []
+    get_mqtt_client = mocker.patch(
+        "consumer.aggregate.get_mqtt_client", return_value=client
+    )
+
+    await aggregate_mqtt(
+        settings.model_copy(update={"delta_spool": tmp_path / "deltas"}),
+        sample_questions,
+        tmp_path / "leaderboard.json",
+    )
+    get_mqtt_client.assert_called_once_with(
+        settings.mqtt, identifier=settings.aggregator_id, clean_session=False
+    )
+    client.subscribe.assert_awaited_once_with(settings.delta_topic, qos=1)
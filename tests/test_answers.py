@@ -1,8 +1,26 @@
 import pytest
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 
-from consumer.answers import Answer
+from consumer.answers import (
+    Answer,
+    AnswerRecord,
+    load_answers,
+    mac_to_int,
+    save_answer,
+)
+
+
+def as_records(answers: list[Answer]) -> list[AnswerRecord]:
+    return [
+        AnswerRecord(
+            received_at=None,
+            device_id=mac_to_int(answer.device_id),
+            question_id=question_key,
+            choice=answer.choice,
+        )
+        for question_key, answer in enumerate(answers)
+    ]
 
 
 @pytest.mark.asyncio
@@ -11,6 +29,20 @@ async def test_many_answers_to_same_question_disallowed(
     sample_answers: list[Answer],
 ) -> None:
     with pytest.raises(IntegrityError):  # noqa: PT012
-        test_db.add_all(sample_answers)
-        test_db.add_all(sample_answers)
+        test_db.add_all(as_records(sample_answers))
+        test_db.add_all(as_records(sample_answers))
         await test_db.commit()
+
+
+@pytest.mark.asyncio
+async def test_saved_answers_load_unchanged(
+    test_engine: AsyncEngine,
+    sample_answers: list[Answer],
+) -> None:
+    for answer in sample_answers:
+        assert await save_answer(answer, test_engine)
+    assert not await save_answer(sample_answers[0], test_engine)
+
+    loaded = await load_answers(test_engine)
+    assert sorted(map(repr, loaded)) == sorted(map(repr, sample_answers))
+    assert all(answer.received_at is not None for answer in loaded)
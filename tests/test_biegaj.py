@@ -0,0 +1,47 @@
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+from consumer.activity import QuizActivity
+from consumer.answers import Answer, ConflictPolicy
+from consumer.questions import Questions
+from consumer.settings import Settings, get_conflict_policy
+from consumer.stats import Statistics
+from consumer.storage import MemoryStorage
+from rustmeet.rustmeet_2025 import biegaj
+from tests.conftest import to_message
+
+
+@pytest.mark.asyncio
+async def test_policy_follows_the_message_topic(
+    settings: Settings,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(biegaj, "EVENTS_FILE", tmp_path / "events.txt")
+    settings = settings.model_copy(
+        update={"conflict_policies": {"quiz/final/#": ConflictPolicy(mode="last-wins")}}
+    )
+    statistics = Statistics.from_questions(sample_questions)
+    storage = MemoryStorage()
+    on_message = partial(
+        biegaj.on_message,
+        statistics,
+        "quiz/#",
+        questions=sample_questions,
+        activity=QuizActivity(statistics.catalog),
+        get_policy=partial(get_conflict_policy, settings),
+    )
+
+    device_id = sample_answers[0].device_id
+    warmup, final = list(sample_questions)[:2]
+    for topic, question_id in (("quiz/warmup/1", warmup), ("quiz/final/1", final)):
+        for choice in (1, 2):
+            payload = f"{device_id}|{question_id}|{choice}".encode()
+            await on_message(to_message(payload, topic), storage)
+
+    kept = {saved.question_id: saved.choice for saved in await storage.load_answers()}
+    assert kept == {warmup: 1, final: 2}
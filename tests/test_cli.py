@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+from typing import NamedTuple
+
+import pytest
+
+from consumer.settings import Settings
+
+
+class ImportReport(NamedTuple):
+    seconds: float
+    modules: set[str]
+
+
+# Generous for `--help`, which imports almost nothing. `prune` has a small margin
+# over its measured lazy cost (about 0.75s), but most of that is logfire and
+# SQLAlchemy, which it needs: the modules it must never import are what catches
+# other commands getting imported eagerly.
+IMPORT_BUDGETS: dict[tuple[str, ...], float] = {
+    ("--help",): 0.5,
+    ("prune",): 0.9,
+}
+# Imports are timed a few times, as the budgets are tight
+RUNS = 3
+NEVER_IMPORTED: dict[tuple[str, ...], set[str]] = {
+    ("--help",): {"aiomqtt", "logfire", "sqlalchemy", "sqlmodel"},
+    ("prune",): {
+        "aiomqtt",
+        "asyncpg",
+        "pyarrow",
+        "yaml",
+        "consumer.activity",
+        "consumer.aggregate",
+        "consumer.export",
+        "consumer.main",
+        "consumer.postgres",
+        "consumer.profiling",
+        "consumer.questions",
+        "consumer.quiz",
+        "consumer.stats",
+        "consumer.wire",
+    },
+}
+
+
+def run_with_importtime(args: tuple[str, ...], settings: Settings) -> ImportReport:
+    env = {
+        **os.environ,
+        "LOGFIRE_SEND_TO_LOGFIRE": "false",
+        "SUBSCRIBER_STORAGE": "memory",
+        "SUBSCRIBER_MQTT_HOSTNAME": settings.mqtt.hostname,
+        "SUBSCRIBER_MQTT_PORT": str(settings.mqtt.port),
+        "SUBSCRIBER_MQTT_USERNAME": settings.mqtt.username,
+        "SUBSCRIBER_MQTT_PASSWORD": settings.mqtt.password.get_secret_value(),
+        "SUBSCRIBER_MQTT_USE_TLS": str(settings.mqtt.use_tls),
+    }
+    process = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-m", "consumer", *args],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    )
+    total_us = 0
+    modules: set[str] = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, module = line.removeprefix("import time:").split("|")
+        if self_us.strip().isdigit():
+            total_us += int(self_us)
+            modules.add(module.strip())
+    return ImportReport(total_us / 1_000_000, modules)
+
+
+@pytest.mark.parametrize("args", list(IMPORT_BUDGETS))
+def test_import_time_budget(args: tuple[str, ...], settings: Settings) -> None:
+    reports = [run_with_importtime(args, settings) for _ in range(RUNS)]
+    assert not reports[0].modules & NEVER_IMPORTED[args]
+    # The fastest run, the others are slowed down by whatever else runs meanwhile
+    assert min(report.seconds for report in reports) < IMPORT_BUDGETS[args]
@@ -0,0 +1,165 @@
+import csv
+import sys
+from datetime import UTC, datetime, timedelta
+from functools import partial
+from pathlib import Path
+from typing import cast
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import SQLModel
+
+from consumer.answers import Answer, Choices
+from consumer.export import COLUMNS, export_answers, export_incrementally
+from consumer.questions import Questions
+from consumer.settings import get_db
+from consumer.storage import MemoryStorage, SQLiteStorage
+
+STARTED = datetime(2025, 5, 10, 12, tzinfo=UTC)
+
+
+def timed(answers: list[Answer]) -> list[Answer]:
+    return [
+        answer.model_copy(update={"received_at": STARTED + timedelta(seconds=second)})
+        for second, answer in enumerate(answers)
+    ]
+
+
+def read_csv(path: Path) -> list[dict[str, str]]:
+    with path.open(newline="", encoding="utf-8") as file:
+        return list(csv.DictReader(file))
+
+
+@pytest.mark.asyncio
+async def test_export_joins_questions(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+    tmp_path: Path,
+) -> None:
+    storage = MemoryStorage()
+    await storage.save_answers(timed(sample_answers))
+
+    exported = await export_answers(
+        storage,
+        sample_questions,
+        tmp_path / "answers.csv",
+        since=STARTED,
+        chunk_size=64,
+    )
+    assert exported.total == len(sample_answers) - 1
+    assert exported.last_received_at == STARTED + timedelta(
+        seconds=len(sample_answers) - 1
+    )
+
+    rows = read_csv(exported.path)
+    assert list(rows[0]) == list(COLUMNS)
+    answer = sample_answers[1]
+    question = sample_questions[answer.question_id]
+    assert rows[0] == {
+        "received_at": str(STARTED + timedelta(seconds=1)),
+        "device_id": answer.device_id,
+        "question_id": answer.question_id,
+        "choice": str(answer.choice),
+        "correct": str(answer.choice == 0),
+        "answer": question.answers.choices[cast("Choices", answer.choice)],
+        "question": question.content,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("suffix", [".parquet", ".arrow"])
+async def test_export_to_columnar_files(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+    tmp_path: Path,
+    suffix: str,
+) -> None:
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    storage = MemoryStorage()
+    await storage.save_answers(timed(sample_answers))
+
+    exported = await export_answers(
+        storage, sample_questions, tmp_path / f"answers{suffix}", chunk_size=64
+    )
+    table = (
+        pq.read_table(exported.path)
+        if suffix == ".parquet"
+        else pa.ipc.open_file(exported.path).read_all()
+    )
+    assert table.column_names == list(COLUMNS)
+    assert table.num_rows == len(sample_answers)
+    assert table["choice"].to_pylist() == [answer.choice for answer in sample_answers]
+
+
+@pytest.mark.asyncio
+async def test_export_falls_back_to_csv(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Imports of modules set to None fail, as if pyarrow wasn't installed
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    storage = MemoryStorage()
+    await storage.save_answers(timed(sample_answers))
+
+    exported = await export_answers(
+        storage, sample_questions, tmp_path / "answers.parquet"
+    )
+    assert exported.path == tmp_path / "answers.csv"
+    assert len(read_csv(exported.path)) == len(sample_answers)
+
+
+@pytest.mark.asyncio
+async def test_incremental_export_waits_for_late_commits(
+    test_engine: AsyncEngine,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+    tmp_path: Path,
+) -> None:
+    storage = SQLiteStorage(test_engine)
+    export = partial(
+        export_incrementally,
+        storage,
+        sample_questions,
+        watermark=tmp_path / "watermark.json",
+        lag=timedelta(seconds=60),
+    )
+    answers = timed(sample_answers)
+    late = answers.pop(130)
+    await storage.save_answers(answers)
+
+    first = await export(tmp_path / "1.csv", now=STARTED + timedelta(seconds=160))
+    # Stamped before the first run, but committed only after it
+    await storage.save_answers([late])
+    second = await export(tmp_path / "2.csv", now=STARTED + timedelta(seconds=400))
+    third = await export(tmp_path / "3.csv", now=STARTED + timedelta(seconds=400))
+
+    assert (first.total, second.total, third.total) == (101, 149, 0)
+    exported = read_csv(first.path) + read_csv(second.path)
+    assert sorted(row["question_id"] for row in exported) == sorted(
+        answer.question_id for answer in sample_answers
+    )
+
+
+@pytest.mark.asyncio
+async def test_answers_are_saved_while_exporting(
+    sample_answers: list[Answer],
+    tmp_path: Path,
+) -> None:
+    async with get_db(str(tmp_path / "answers.db")) as db:
+        async with db.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+        storage = SQLiteStorage(db)
+        answers = timed(sample_answers)
+        await storage.save_answers(answers[:200])
+
+        chunks = storage.stream_answers(chunk_size=50)
+        exported = [*await anext(chunks)]
+        # The live consumer keeps saving while an analyst exports
+        assert await storage.save_answers(answers[200:]) == answers[200:]
+        async for chunk in chunks:
+            exported.extend(chunk)
+
+    assert exported == answers
@@ -0,0 +1,224 @@
+import asyncio
+from collections.abc import AsyncIterator
+from types import TracebackType
+from typing import Self
+
+import aiomqtt
+import pytest
+from pytest_mock import MockerFixture
+
+from consumer.admission import AdmissionControl
+from consumer.answers import Answer
+from consumer.main import consume_messages
+from consumer.settings import Settings
+from consumer.storage import BatchingStorage, MemoryStorage, Storage
+from tests.conftest import to_message
+
+TOPIC = "answer"
+
+
+class FakeClient:
+    """Broker connection whose incoming messages are queued by the test."""
+
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue[aiomqtt.Message] = asyncio.Queue()
+        self.calls: list[str] = []
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.calls.append("disconnect")
+
+    async def subscribe(self, topic: str) -> None:
+        self.calls.append(f"subscribe {topic}")
+
+    async def unsubscribe(self, topic: str) -> None:
+        self.calls.append(f"unsubscribe {topic}")
+
+    @property
+    def messages(self) -> Self:
+        return self
+
+    def __aiter__(self) -> AsyncIterator[aiomqtt.Message]:
+        return self
+
+    async def __anext__(self) -> aiomqtt.Message:
+        return await self.queue.get()
+
+    def __len__(self) -> int:
+        return self.queue.qsize()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_answers_in_flight(
+    mocker: MockerFixture,
+    settings: Settings,
+    sample_answers: list[Answer],
+) -> None:
+    client = FakeClient()
+    mocker.patch("consumer.main.get_mqtt_client", return_value=client)
+    backend = MemoryStorage()
+    storage = BatchingStorage(backend)
+    stopping = asyncio.Event()
+
+    async def callback(message: aiomqtt.Message, storage: Storage) -> None:
+        await asyncio.sleep(0.01)
+        assert isinstance(message.payload, bytes)
+        await storage.save_answers([Answer.from_message(message.payload.decode())])
+
+    async def on_shutdown() -> None:
+        await storage.flush()
+        client.calls.append(f"shutdown with {len(backend.answers)} answers")
+
+    consuming = asyncio.create_task(
+        consume_messages(
+            callback=callback,
+            storage=storage,
+            settings=settings,
+            topics=[TOPIC],
+            stopping=stopping,
+            on_shutdown=on_shutdown,
+        )
+    )
+    for answer in sample_answers[:100]:
+        client.queue.put_nowait(to_message(answer, TOPIC))
+    await asyncio.sleep(0)
+    stopping.set()
+    # Arrives after stopping but before unsubscribing, so it is drained too
+    for answer in sample_answers[100:]:
+        client.queue.put_nowait(to_message(answer, TOPIC))
+    await consuming
+
+    assert client.calls == [
+        f"subscribe {TOPIC}",
+        f"unsubscribe {TOPIC}",
+        f"shutdown with {len(sample_answers)} answers",
+        "disconnect",
+    ]
+
+
+class DisconnectingClient(FakeClient):
+    """Broker connection dropping as soon as the consumer unsubscribes."""
+
+    async def unsubscribe(self, topic: str) -> None:
+        self.calls.append(f"unsubscribe {topic}")
+        msg = "Disconnected during message iteration"
+        raise aiomqtt.MqttError(msg)
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_without_the_broker(
+    mocker: MockerFixture,
+    settings: Settings,
+    sample_answers: list[Answer],
+) -> None:
+    client = DisconnectingClient()
+    mocker.patch("consumer.main.get_mqtt_client", return_value=client)
+    storage = MemoryStorage()
+    stopping = asyncio.Event()
+
+    async def callback(message: aiomqtt.Message, storage: Storage) -> None:
+        await asyncio.sleep(0.01)
+        assert isinstance(message.payload, bytes)
+        await storage.save_answers([Answer.from_message(message.payload.decode())])
+
+    async def on_shutdown() -> None:
+        client.calls.append(f"shutdown with {len(storage.answers)} answers")
+
+    consuming = asyncio.create_task(
+        consume_messages(
+            callback=callback,
+            storage=storage,
+            settings=settings,
+            topics=[TOPIC],
+            stopping=stopping,
+            on_shutdown=on_shutdown,
+        )
+    )
+    for answer in sample_answers:
+        client.queue.put_nowait(to_message(answer, TOPIC))
+    await asyncio.sleep(0)
+    stopping.set()
+    await asyncio.wait_for(consuming, timeout=5)
+
+    # The answers in flight were saved, only the queued ones were left behind
+    saved = len(storage.answers)
+    assert saved > 0
+    assert client.calls == [
+        f"subscribe {TOPIC}",
+        f"unsubscribe {TOPIC}",
+        f"shutdown with {saved} answers",
+        "disconnect",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_shutdown_gives_up_after_deadline(
+    mocker: MockerFixture,
+    settings: Settings,
+    sample_answers: list[Answer],
+) -> None:
+    client = FakeClient()
+    mocker.patch("consumer.main.get_mqtt_client", return_value=client)
+    stopping = asyncio.Event()
+    saved: list[aiomqtt.Message] = []
+
+    async def stuck_callback(message: aiomqtt.Message, _storage: Storage) -> None:
+        await asyncio.sleep(3600)
+        saved.append(message)
+
+    client.queue.put_nowait(to_message(sample_answers[0], TOPIC))
+    stopping.set()
+    await asyncio.wait_for(
+        consume_messages(
+            callback=stuck_callback,
+            storage=MemoryStorage(),
+            settings=settings.model_copy(update={"shutdown_deadline": 0.05}),
+            topics=[TOPIC],
+            stopping=stopping,
+        ),
+        timeout=5,
+    )
+    assert saved == []
+    assert client.calls[-1] == "disconnect"
+
+
+@pytest.mark.asyncio
+async def test_flooding_device_is_shed(
+    mocker: MockerFixture,
+    settings: Settings,
+    sample_answers: list[Answer],
+) -> None:
+    client = FakeClient()
+    mocker.patch("consumer.main.get_mqtt_client", return_value=client)
+    admission = AdmissionControl(device_rate=0, device_burst=1, global_rate=1000)
+    stopping = asyncio.Event()
+    received: list[aiomqtt.Message] = []
+
+    async def callback(message: aiomqtt.Message, _storage: Storage) -> None:
+        received.append(message)
+
+    flood = [
+        sample_answers[0].model_copy(update={"question_id": f"spam {number}"})
+        for number in range(100)
+    ]
+    for answer in [*flood, *sample_answers[1:]]:
+        client.queue.put_nowait(to_message(answer, TOPIC))
+    stopping.set()
+    await consume_messages(
+        callback=callback,
+        storage=MemoryStorage(),
+        settings=settings,
+        topics=[TOPIC],
+        stopping=stopping,
+        admission=admission,
+    )
+    # Only the first message of the flood gets through, every other device does too
+    assert len(received) == len(sample_answers)
+    assert admission.shed == {"device": len(flood) - 1}
@@ -0,0 +1,61 @@
+import asyncio
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from consumer.profiling import PROFILER_STACK, AsyncProfiler, capture_profile, stage
+
+
+async def save_slowly() -> None:
+    with stage("save"):
+        await asyncio.sleep(1)
+
+
+@pytest.mark.asyncio
+async def test_profile_attributes_awaits_to_stages(tmp_path: Path) -> None:
+    workers = [asyncio.create_task(save_slowly()) for _ in range(3)]
+    path = await capture_profile(duration=0.1, interval=0.01, directory=tmp_path)
+    for worker in workers:
+        worker.cancel()
+
+    folded = dict(line.rsplit(" ", 1) for line in path.read_text().splitlines())
+    (stack,) = (stack for stack in folded if stack.startswith("[save];"))
+    assert "save_slowly (test_profiling.py" in stack
+    assert "sleep (tasks.py" in stack
+    # Three tasks waited for about the whole window, weighted in microseconds
+    assert int(folded[stack]) >= 3 * 90_000
+
+
+@pytest.mark.asyncio
+async def test_profile_caps_the_tasks_walked_per_sample(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    workers = [asyncio.create_task(save_slowly()) for _ in range(50)]
+    await asyncio.sleep(0)
+    walked: list[asyncio.Task[Any]] = []
+
+    def walk(task: asyncio.Task[Any]) -> list[str]:
+        walked.append(task)
+        return ["[save]"]
+
+    monkeypatch.setattr("consumer.profiling.task_stack", walk)
+    profiler = AsyncProfiler(interval=0.01, max_tasks=5)
+    sample = profiler.sample
+    per_sample: list[int] = []
+
+    def count(elapsed: float) -> None:
+        walked.clear()
+        sample(elapsed)
+        per_sample.append(len(walked))
+
+    monkeypatch.setattr(profiler, "sample", count)
+    await profiler.run(0.05)
+    for worker in workers:
+        worker.cancel()
+
+    assert per_sample
+    assert set(per_sample) == {5}
+    # Weights are scaled up, so the sampled tasks still stand for all of them
+    assert profiler.samples["[save]"] >= 50 * 40_000
+    assert profiler.samples[PROFILER_STACK] > 0
@@ -0,0 +1,148 @@
+import time
+from collections.abc import Generator
+from datetime import UTC, datetime
+
+import pytest
+from pydantic import ValidationError
+from pydantic_extra_types.mac_address import MacAddress
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from consumer.answers import Answer, ConflictPolicy
+from consumer.questions import Questions
+from consumer.scoring import QuizSchedule, Scoring, ScoringRules
+from consumer.stats import Statistics, stats_from_storage, update_stats
+from consumer.storage import MemoryStorage, SQLiteStorage
+from rustmeet.rustmeet_2025.biegaj import get_leaderboard
+from tests.conftest import to_message
+
+RULES = ScoringRules(correct_points=500, speed_points=500, time_limit=30.0)
+FASTEST_POINTS = 1000
+
+
+@pytest.fixture
+def warsaw_time() -> Generator[None]:
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("TZ", "Europe/Warsaw")
+        time.tzset()
+        yield
+    time.tzset()
+
+
+@pytest.mark.parametrize(
+    "rules",
+    [{"time_limit": 0}, {"correct_points": -1}, {"speed_points": -500}],
+)
+def test_scoring_rules_are_validated(rules: dict[str, float]) -> None:
+    with pytest.raises(ValidationError):
+        ScoringRules.model_validate(rules)
+
+
+def scored_statistics(questions: Questions) -> Statistics:
+    statistics = Statistics.from_questions(questions)
+    statistics.scoring = Scoring(RULES, QuizSchedule(statistics.catalog))
+    return statistics
+
+
+@pytest.mark.asyncio
+async def test_answers_outside_the_window_are_rejected(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    statistics = scored_statistics(sample_questions)
+    assert statistics.scoring is not None
+    schedule = statistics.scoring.schedule
+    closed, opened, unscheduled = sample_answers[:3]
+    now = time.time()
+    schedule.update("open", closed.question_id, at=now - 60)
+    schedule.update("close", closed.question_id, at=now - 30)
+    schedule.update("open", opened.question_id, at=now)
+    storage = MemoryStorage()
+
+    for answer in (closed, opened, unscheduled):
+        await update_stats(statistics, to_message(answer), storage, sample_questions)
+
+    saved = {answer.question_id for answer in await storage.load_answers()}
+    assert saved == {opened.question_id, unscheduled.question_id}
+    assert closed.device_id not in statistics
+
+
+def test_score_follows_replaced_answers(sample_questions: Questions) -> None:
+    statistics = scored_statistics(sample_questions)
+    assert statistics.scoring is not None
+    question_id, other_question_id = list(sample_questions)[:2]
+    opened_at = datetime(2025, 5, 10, 12, tzinfo=UTC)
+    for qid in (question_id, other_question_id):
+        statistics.scoring.schedule.update("open", qid, at=opened_at.timestamp())
+
+    def answer(qid: str, choice: int, elapsed: float) -> None:
+        received_at = datetime.fromtimestamp(opened_at.timestamp() + elapsed, UTC)
+        statistics.add_answer(
+            sample_questions[qid],
+            Answer.model_construct(
+                received_at=received_at,
+                device_id=MacAddress("00:b0:d0:63:c2:26"),
+                question_id=qid,
+                choice=choice,
+            ),
+        )
+
+    answer(question_id, choice=0, elapsed=7.5)
+    answer(other_question_id, choice=0, elapsed=0)
+    (device_statistics,) = statistics.values()
+    assert device_statistics.score == 875 + FASTEST_POINTS
+
+    # A last-wins replacement takes back the points of the replaced answer
+    answer(question_id, choice=1, elapsed=10)
+    assert device_statistics.score == FASTEST_POINTS
+    answer(question_id, choice=0, elapsed=15)
+    assert device_statistics.score == 750 + FASTEST_POINTS
+    assert device_statistics.total_correct_answers == device_statistics.total_answers
+
+
+@pytest.mark.asyncio
+async def test_leaderboard_ranks_by_score(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    statistics = scored_statistics(sample_questions)
+    storage = MemoryStorage()
+    policy = ConflictPolicy(mode="last-wins")
+    for answer in sample_answers:
+        await update_stats(
+            statistics, to_message(answer), storage, sample_questions, policy=policy
+        )
+
+    leaderboard = get_leaderboard(statistics)
+    ranks = [item.rank_key for item in leaderboard]
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == len(ranks)
+    assert all(
+        item.device_statistics.score
+        == RULES.correct_points * item.device_statistics.total_correct_answers
+        for item in leaderboard
+    )
+
+
+@pytest.mark.usefixtures("warsaw_time")
+@pytest.mark.asyncio
+async def test_rebuilt_scores_match_live_ones(
+    test_engine: AsyncEngine,
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    statistics = scored_statistics(sample_questions)
+    assert statistics.scoring is not None
+    answers = sample_answers[:20]
+    for answer in answers:
+        statistics.scoring.schedule.update(
+            "open", answer.question_id, at=time.time() - 5
+        )
+    storage = SQLiteStorage(test_engine)
+    for answer in answers:
+        await update_stats(statistics, to_message(answer), storage, sample_questions)
+
+    # SQLite hands back naive timestamps, they must not be read as local time
+    rebuilt = await stats_from_storage(storage, sample_questions, statistics.scoring)
+    scores = {device_id: stats.score for device_id, stats in statistics.items()}
+    assert {device_id: stats.score for device_id, stats in rebuilt.items()} == scores
+    assert any(0 < score < FASTEST_POINTS for score in scores.values())
@@ -0,0 +1,19 @@
+from datetime import UTC, datetime
+
+from consumer.answers import ConflictPolicy
+from consumer.settings import Settings, get_conflict_policy
+
+
+def test_conflict_policy_is_resolved_per_topic(settings: Settings) -> None:
+    final = ConflictPolicy(
+        mode="last-wins-until-deadline",
+        deadline=datetime(2025, 5, 10, 12, tzinfo=UTC),
+    )
+    settings = settings.model_copy(
+        update={
+            "conflict_policy": ConflictPolicy(mode="last-wins"),
+            "conflict_policies": {"quiz/final/#": final},
+        }
+    )
+    assert get_conflict_policy(settings, "quiz/final/7") == final
+    assert get_conflict_policy(settings, "quiz/warmup/1") == settings.conflict_policy
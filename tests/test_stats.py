@@ -0,0 +1,118 @@
+import json
+import tracemalloc
+
+from pydantic import TypeAdapter
+from pydantic_extra_types.mac_address import MacAddress
+
+from consumer.answers import Answer, int_to_mac
+from consumer.questions import Questions
+from consumer.stats import Statistics, StatisticsSnapshot
+
+# A device holds a few integers, so it must stay well below a dict of models
+MAX_BYTES_PER_DEVICE = 400
+QUIZ_SIZE = 20
+
+
+def test_totals_and_export(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    statistics = Statistics.from_questions(sample_questions)
+    for answer in sample_answers:
+        question = sample_questions[answer.question_id]
+        statistics[answer.device_id].add_answer(question, answer)
+
+    assert sum(stats.total_answers for stats in statistics.values()) == len(
+        sample_answers
+    )
+    assert sum(stats.total_correct_answers for stats in statistics.values()) == sum(
+        answer.choice == 0 for answer in sample_answers
+    )
+
+    exported = json.loads(TypeAdapter(Statistics).dump_json(statistics))
+    for answer in sample_answers:
+        assert exported[answer.device_id]["answers"][answer.question_id] == {
+            "device_id": answer.device_id,
+            "question_id": answer.question_id,
+            "choice": answer.choice,
+        }
+
+
+def test_memory_per_device(sample_questions: Questions) -> None:
+    questions = dict(list(sample_questions.items())[:QUIZ_SIZE])
+    devices = [MacAddress(int_to_mac(device)) for device in range(10_000)]
+    answers = [
+        Answer.model_construct(
+            received_at=None, device_id=device, question_id=question_id, choice=1
+        )
+        for device in devices
+        for question_id in questions
+    ]
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        statistics = Statistics.from_questions(questions)
+        for answer in answers:
+            question = questions[answer.question_id]
+            statistics[answer.device_id].add_answer(question, answer)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert (after - before) / len(devices) < MAX_BYTES_PER_DEVICE
+
+
+def test_snapshots_are_immutable_and_shared(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    statistics = Statistics.from_questions(sample_questions)
+    first, second, *rest = sample_answers
+    statistics.add_answer(sample_questions[first.question_id], first)
+    before = statistics.snapshot()
+    assert statistics.snapshot() is before
+    assert before.age >= 0
+
+    statistics.add_answer(sample_questions[second.question_id], second)
+    changed = first.model_copy(update={"choice": (first.choice + 1) % 4})
+    statistics.add_answer(sample_questions[first.question_id], changed)
+    after = statistics.snapshot()
+    assert after.version > before.version
+    assert list(before) == [first.device_id]
+    assert before[first.device_id].answers[first.question_id].choice == first.choice
+    assert after[first.device_id].answers[first.question_id].choice == changed.choice
+
+    for answer in rest:
+        statistics.add_answer(sample_questions[answer.question_id], answer)
+    latest = statistics.snapshot()
+    # Devices that didn't change since the previous snapshot are shared with it
+    assert latest[second.device_id] is after[second.device_id]
+    assert TypeAdapter(StatisticsSnapshot).dump_python(latest) == TypeAdapter(
+        Statistics
+    ).dump_python(statistics)
+    assert len(latest) == len(sample_answers)
+
+
+def test_snapshots_reuse_unchanged_serialized_devices(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    statistics = Statistics.from_questions(sample_questions)
+    first, *rest = sample_answers
+    for answer in rest:
+        statistics.add_answer(sample_questions[answer.question_id], answer)
+    previous = statistics.snapshot()
+    before = previous.as_dict()
+
+    statistics.add_answer(sample_questions[first.question_id], first)
+    snapshot = statistics.snapshot()
+    after = snapshot.as_dict()
+    assert after[first.device_id]["answers"][first.question_id]["choice"] == (
+        first.choice
+    )
+    assert all(after[device_id] is before[device_id] for device_id in before)
+    # Only the chunk holding the new device was copied
+    copied = [
+        chunk is not previous_chunk
+        for chunk, previous_chunk in zip(snapshot.chunks, previous.chunks, strict=True)
+    ]
+    assert copied.count(True) == 1
@@ -0,0 +1,195 @@
+import asyncio
+import os
+from collections.abc import AsyncGenerator, Sequence
+from datetime import UTC, datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from consumer.answers import FIRST_WINS, Answer, ConflictPolicy, DeletedTotal
+from consumer.storage import BatchingStorage, MemoryStorage, SQLiteStorage, Storage
+
+SUBSCRIBER_TEST_POSTGRES_DSN = os.getenv("SUBSCRIBER_TEST_POSTGRES_DSN")
+
+
+@pytest_asyncio.fixture(
+    loop_scope="function",
+    params=[
+        "memory",
+        "sqlite",
+        pytest.param(
+            "postgres",
+            marks=pytest.mark.skipif(
+                not SUBSCRIBER_TEST_POSTGRES_DSN,
+                reason="SUBSCRIBER_TEST_POSTGRES_DSN is not set",
+            ),
+        ),
+    ],
+)
+async def storage(
+    request: pytest.FixtureRequest,
+    test_engine: AsyncEngine,
+) -> AsyncGenerator[Storage]:
+    match request.param:
+        case "memory":
+            yield MemoryStorage()
+        case "sqlite":
+            yield SQLiteStorage(test_engine)
+        case "postgres":
+            from consumer.postgres import PostgresStorage  # noqa: PLC0415
+
+            assert SUBSCRIBER_TEST_POSTGRES_DSN
+            async with PostgresStorage.connect(SUBSCRIBER_TEST_POSTGRES_DSN) as pg:
+                await pg.prune()
+                try:
+                    yield pg
+                finally:
+                    await pg.prune()
+
+
+def dump(answers: Sequence[Answer]) -> list[str]:
+    return sorted(map(repr, answers))
+
+
+@pytest.mark.asyncio
+async def test_save_batch_keeps_first_answers(
+    storage: Storage,
+    sample_answers: list[Answer],
+) -> None:
+    first, second = sample_answers[:100], sample_answers[50:]
+    assert dump(await storage.save_answers(first)) == dump(first)
+    assert dump(await storage.save_answers(second)) == dump(second[50:])
+
+    overriding = sample_answers[0].model_copy(update={"choice": 3})
+    assert await storage.save_answers([overriding]) == []
+    assert dump(await storage.load_answers()) == dump(sample_answers)
+
+
+@pytest.mark.asyncio
+async def test_dedup_check_and_aggregates(
+    storage: Storage,
+    sample_answers: list[Answer],
+) -> None:
+    await storage.save_answers(sample_answers)
+    answer = sample_answers[0]
+    assert await storage.is_answered(answer.device_id, answer.question_id)
+    assert not await storage.is_answered(answer.device_id, "not asked yet")
+
+    choices = await storage.count_choices()
+    assert sum(choices.values()) == len(sample_answers)
+    assert choices[answer.question_id, answer.choice] >= 1
+    per_second = await storage.count_answers_per_second(window_seconds=60)
+    assert sum(per_second.values()) == len(sample_answers)
+
+    assert await storage.prune() == DeletedTotal(len(sample_answers))
+    assert await storage.load_answers() == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_saves_are_batched(sample_answers: list[Answer]) -> None:
+    backend = MemoryStorage()
+    batch_sizes: list[int] = []
+    save_answers = backend.save_answers
+
+    async def spy(
+        answers: Sequence[Answer],
+        policy: ConflictPolicy = FIRST_WINS,
+    ) -> list[Answer]:
+        batch_sizes.append(len(answers))
+        await asyncio.sleep(0)
+        return await save_answers(answers, policy)
+
+    backend.save_answers = spy  # type: ignore[method-assign]
+    storage = BatchingStorage(backend, max_batch_size=100)
+    duplicate = sample_answers[0].model_copy(update={"choice": 3})
+    kept = await asyncio.gather(
+        *(storage.save_answers([answer]) for answer in [*sample_answers, duplicate])
+    )
+    assert sum(map(len, kept)) == len(sample_answers)
+    assert kept[-1] == []
+    assert len(batch_sizes) < len(sample_answers)
+    assert max(batch_sizes) <= storage.max_batch_size
+
+
+@pytest.mark.asyncio
+async def test_last_answer_wins(storage: Storage, sample_answers: list[Answer]) -> None:
+    last_wins = ConflictPolicy(mode="last-wins")
+    first, *_ = sample_answers
+    changed = first.model_copy(update={"choice": (first.choice + 1) % 4})
+    await storage.save_answers(sample_answers, last_wins)
+
+    assert dump(await storage.save_answers([changed], last_wins)) == dump([changed])
+    assert dump(await storage.save_answers([first], FIRST_WINS)) == []
+    loaded = {repr(answer) for answer in await storage.load_answers()}
+    assert repr(changed) in loaded
+    assert repr(first) not in loaded
+
+    # Of duplicates within one batch, the last one is kept
+    assert dump(await storage.save_answers([first, changed], last_wins)) == dump(
+        [changed]
+    )
+
+
+@pytest.mark.asyncio
+async def test_answers_after_deadline_are_not_kept(
+    storage: Storage,
+    sample_answers: list[Answer],
+) -> None:
+    first, *_ = sample_answers
+    closed = ConflictPolicy(
+        mode="last-wins-until-deadline",
+        deadline=datetime.now(UTC) - timedelta(seconds=1),
+    )
+    assert await storage.save_answers([first], closed) == []
+    assert await storage.load_answers() == []
+
+
+@pytest.mark.asyncio
+async def test_batched_duplicates_resolve_to_the_kept_answer(
+    sample_answers: list[Answer],
+) -> None:
+    storage = BatchingStorage(MemoryStorage())
+    first, *_ = sample_answers
+    changed = first.model_copy(update={"choice": (first.choice + 1) % 4})
+    last_wins = ConflictPolicy(mode="last-wins")
+    kept = await asyncio.gather(
+        storage.save_answers([first], last_wins),
+        storage.save_answers([changed], last_wins),
+    )
+    assert [dump(answers) for answers in kept] == [[], dump([changed])]
+
+
+@pytest.mark.asyncio
+async def test_stream_answers_in_chunks_within_range(
+    storage: Storage,
+    sample_answers: list[Answer],
+) -> None:
+    started = datetime(2025, 5, 10, 12, tzinfo=UTC)
+    await storage.save_answers(
+        [
+            answer.model_copy(
+                update={"received_at": started + timedelta(seconds=second)}
+            )
+            for second, answer in enumerate(sample_answers)
+        ]
+    )
+
+    chunks = [chunk async for chunk in storage.stream_answers(chunk_size=100)]
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    streamed = [answer for chunk in chunks for answer in chunk]
+    assert dump(streamed) == dump(sample_answers)
+    # Oldest first, so that an export can continue after the last one
+    assert [answer.question_id for answer in streamed] == [
+        answer.question_id for answer in sample_answers
+    ]
+
+    in_range = [
+        answer
+        async for chunk in storage.stream_answers(
+            since=started + timedelta(seconds=9),
+            until=started + timedelta(seconds=19),
+        )
+        for answer in chunk
+    ]
+    assert dump(in_range) == dump(sample_answers[10:20])
@@ -0,0 +1,79 @@
+import pytest
+
+from consumer.answers import Answer
+from consumer.questions import QuestionCatalog, Questions
+from consumer.stats import Statistics, update_stats
+from consumer.storage import MemoryStorage
+from consumer.wire import RECORD, answers_from_message, encode_answers
+from tests.conftest import to_message
+
+
+def test_formats_are_detected(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    catalog = QuestionCatalog.from_questions(sample_questions)
+    with_header = encode_answers(sample_answers, catalog)
+    records = encode_answers(sample_answers, catalog, header=False)
+    assert len(records) == RECORD.size * len(sample_answers)
+
+    answer = sample_answers[0]
+    text = f"{answer.device_id}|{answer.question_id}|{answer.choice}".encode()
+    assert answers_from_message(to_message(text), catalog) == [answer]
+    assert answers_from_message(to_message(with_header), catalog) == sample_answers
+    assert (
+        answers_from_message(
+            to_message(records, "answer/binary"),
+            catalog,
+            binary_topics=["answer/binary"],
+        )
+        == sample_answers
+    )
+    with pytest.raises(ValueError, match="bytes"):
+        answers_from_message(to_message(records[:-1], "answer/binary"), catalog, ["#"])
+
+
+def test_records_on_binary_topics_are_never_read_as_a_header(
+    sample_questions: Questions,
+) -> None:
+    catalog = QuestionCatalog.from_questions(sample_questions)
+    # The first byte of this MAC address is the magic byte
+    answers = [
+        Answer.from_message(f"{device_id}|{question_id}|1")
+        for device_id, question_id in zip(
+            ("A5-4C-F3-98-9D-E2", "00-B0-D0-63-C2-26"), catalog.ids, strict=False
+        )
+    ]
+    records = encode_answers(answers, catalog, header=False)
+    message = to_message(records, "answer/binary")
+    assert answers_from_message(message, catalog, ["answer/binary"]) == answers
+
+
+@pytest.mark.asyncio
+async def test_binary_batch_updates_statistics(
+    sample_answers: list[Answer],
+    sample_questions: Questions,
+) -> None:
+    statistics = Statistics.from_questions(sample_questions)
+    payload = encode_answers(sample_answers, statistics.catalog)
+    message = to_message(payload)
+    storage = MemoryStorage()
+
+    updated = await update_stats(statistics, message, storage, sample_questions)
+    assert [answer for _, answer in updated] == await storage.load_answers()
+    assert sum(stats.total_answers for stats in statistics.values()) == len(
+        sample_answers
+    )
+    assert await update_stats(statistics, message, storage, sample_questions) == []
+
+
+@pytest.mark.asyncio
+async def test_truncated_binary_payload_is_ignored(
+    sample_questions: Questions,
+) -> None:
+    statistics = Statistics.from_questions(sample_questions)
+    storage = MemoryStorage()
+    for payload in (b"\xa5", b"\xa5\x01" + bytes(RECORD.size - 1)):
+        message = to_message(payload)
+        assert await update_stats(statistics, message, storage, sample_questions) == []
+    assert await storage.load_answers() == []